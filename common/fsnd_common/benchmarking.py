@@ -0,0 +1,177 @@
+import http.client
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+import tracemalloc
+from urllib.parse import urlencode
+
+from sqlalchemy import event
+from werkzeug.serving import make_server
+
+# helpers shared by the benchmark.py scripts of fyyur and the trivia API
+
+BATCH_SIZE = 10000
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _count(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(self.engine, 'before_cursor_execute', self._count)
+
+
+def insert_batched(session, table, rows, batch_size=BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            session.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        session.execute(table.insert(), batch)
+    session.commit()
+
+
+def percentile(timings, fraction):
+    timings = sorted(timings)
+    return timings[min(int(len(timings) * fraction), len(timings) - 1)]
+
+
+def peak_alloc_kib(func):
+    # the most memory python allocated at once while func ran. unlike the process's peak rss, a
+    # lifetime high-water mark, this is func's alone. tracemalloc slows every allocation down, so
+    # never call this inside a timed loop
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024
+
+
+# Requests
+# ----------------------------------------------------------------
+
+class ClientRequester:
+    # bodies are posted as a form, or as json with json_body
+    def __init__(self, app, session, json_body=False):
+        self.client = app.test_client()
+        self.session = session
+        self.json_body = json_body
+
+    def __call__(self, method, path, body):
+        if self.json_body:
+            status = self.client.open(path, method=method, json=body).status_code
+        else:
+            status = self.client.open(path, method=method, data=body).status_code
+        # the benchmark's app context outlives the request, so end the session as its teardown would
+        self.session.remove()
+        return status
+
+    def close(self):
+        pass
+
+
+class ServerRequester:
+    # a werkzeug server on a free local port, requested over HTTP from this thread
+    def __init__(self, app, json_body=False):
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        self.json_body = json_body
+        self.server = make_server('127.0.0.1', 0, app)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.connection = http.client.HTTPConnection('127.0.0.1', self.server.port)
+
+    def __call__(self, method, path, body):
+        headers = {}
+        if body is not None and self.json_body:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        elif body is not None:
+            body = urlencode(body, doseq=True)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        self.connection.request(method, path, body, headers)
+        response = self.connection.getresponse()
+        response.read()
+        return response.status
+
+    def close(self):
+        self.connection.close()
+        self.server.shutdown()
+
+
+def time_route(requester, engine, method, path, body, repeat):
+    # one untimed request first, so template compiles and cold caches are not in the percentiles,
+    # then one traced request for the memory of this route alone, then the timed ones
+    def request():
+        return requester(method, path() if callable(path) else path, body)
+
+    request()
+    peak_kib = peak_alloc_kib(request)
+    timings = []
+    statuses = set()
+    with QueryCounter(engine) as counter:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            statuses.add(request())
+            timings.append(time.perf_counter() - started)
+    return {
+        'method': method,
+        'requests': repeat,
+        'statuses': sorted(statuses),
+        'throughput_rps': round(repeat / sum(timings), 1),
+        'p50_ms': round(1000 * percentile(timings, 0.5), 2),
+        'p95_ms': round(1000 * percentile(timings, 0.95), 2),
+        'p99_ms': round(1000 * percentile(timings, 0.99), 2),
+        'queries_per_request': counter.count / repeat,
+        'peak_alloc_kib': round(peak_kib, 1),
+    }
+
+
+# Reports
+# ----------------------------------------------------------------
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_route_header():
+    print('{:<20} {:>8} {:>9} {:>9} {:>9} {:>9} {:>10}'.format(
+        'endpoint', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'peak KiB'))
+
+
+def print_route(name, stats):
+    print('{:<20} {:>8.1f} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.1f} {:>10.1f}'.format(
+        name, stats['throughput_rps'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms'],
+        stats['queries_per_request'], stats['peak_alloc_kib']))
+
+
+def compare(report, path):
+    # p50/p95 and query count changes against an earlier report, per endpoint
+    with open(path) as file:
+        before = json.load(file)['endpoints']
+    print('\n{:<20} {:>12} {:>12} {:>14}'.format('vs ' + os.path.basename(path), 'p50', 'p95', 'queries'))
+    for name, stats in report['endpoints'].items():
+        if name in before:
+            old = before[name]
+            print('{:<20} {:>+11.1f}% {:>+11.1f}% {:>+14.1f}'.format(
+                name, 100 * (stats['p50_ms'] / old['p50_ms'] - 1) if old['p50_ms'] else 0.0,
+                100 * (stats['p95_ms'] / old['p95_ms'] - 1) if old['p95_ms'] else 0.0,
+                stats['queries_per_request'] - old['queries_per_request']))
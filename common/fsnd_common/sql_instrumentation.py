@@ -0,0 +1,156 @@
+import heapq
+import json
+import logging
+import os
+import time
+import weakref
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+# per-request SQL instrumentation shared by the Flask projects of this repository. each project's
+# instrumentation.py is an adapter that passes init_app() the engines its requests use
+
+# one json line per request: query count, database time and the slowest statements
+request_logger = logging.getLogger('sql.requests')
+# one json line per statement slower than SQL_SLOW_QUERY_MS
+slow_logger = logging.getLogger('sql.slow')
+
+# used for settings the app config leaves out
+DEFAULTS = {
+    'SQL_SLOW_QUERY_MS': int(os.environ.get('SQL_SLOW_QUERY_MS', 100)),
+    'SQL_SLOWEST_STATEMENTS': 3,
+    # file the slow queries are appended to, besides any handlers already on 'sql.slow'
+    'SQL_SLOW_QUERY_LOG': os.environ.get('SQL_SLOW_QUERY_LOG'),
+    'SQL_SERVER_TIMING': True,
+}
+
+
+class RequestStats:
+    def __init__(self, method, path, slow_query_ms, keep):
+        self.started = time.perf_counter()
+        self.method = method
+        self.path = path
+        self.slow_query_ms = slow_query_ms
+        self.keep = keep
+        self.queries = 0
+        self.db_time = 0.0
+        # min-heap of (seconds, statement), so the fastest of the kept statements is dropped first
+        self.slowest = []
+
+    def record(self, statement, seconds):
+        self.queries += 1
+        self.db_time += seconds
+        if len(self.slowest) < self.keep:
+            heapq.heappush(self.slowest, (seconds, statement))
+        elif self.slowest and seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (seconds, statement))
+        if seconds * 1000 >= self.slow_query_ms:
+            slow_logger.warning(json.dumps({'method': self.method, 'path': self.path,
+                                            'ms': round(seconds * 1000, 2), 'statement': statement}))
+
+    def summary(self, status):
+        return {
+            'method': self.method,
+            'path': self.path,
+            'status': status,
+            'queries': self.queries,
+            'db_ms': round(self.db_time * 1000, 2),
+            'app_ms': round((time.perf_counter() - self.started) * 1000, 2),
+            'slowest': [{'ms': round(seconds * 1000, 2), 'statement': statement}
+                        for seconds, statement in sorted(self.slowest, reverse=True)],
+        }
+
+    def server_timing(self):
+        return 'db;dur={:.2f};desc="{} queries", app;dur={:.2f}'.format(
+            self.db_time * 1000, self.queries, (time.perf_counter() - self.started) * 1000)
+
+
+# Engine events
+# ----------------------------------------------------------------
+
+# engines already listened on, so instrument() can run on every request
+instrumented = weakref.WeakSet()
+
+
+def current_stats():
+    return g.get('sql_stats') if has_request_context() else None
+
+
+def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    # the start time rides on the statement's execution context, which is dropped with it
+    # whether the statement succeeds or fails
+    if context is not None and current_stats() is not None:
+        context.sql_started = time.perf_counter()
+
+
+def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    finished(statement, context)
+
+
+def handle_error(exception_context):
+    # a failed statement spent database time too
+    finished(exception_context.statement, exception_context.execution_context)
+
+
+def finished(statement, context):
+    stats = current_stats()
+    started = getattr(context, 'sql_started', None)
+    if stats is not None and started is not None:
+        stats.record(statement, time.perf_counter() - started)
+
+
+def instrument(engine):
+    # time the statements engine runs while a request is being served
+    if engine in instrumented:
+        return
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(engine, 'handle_error', handle_error)
+    instrumented.add(engine)
+
+
+# Requests
+# ----------------------------------------------------------------
+
+def log_request(stats, status):
+    if request_logger.isEnabledFor(logging.INFO):
+        request_logger.info(json.dumps(stats.summary(status)))
+
+
+def finish_request(response):
+    stats = g.get('sql_stats')
+    if stats is None:
+        return response
+    if response.is_streamed:
+        # the body runs its queries after the headers are sent, so there is no Server-Timing
+        # header; the request log line is written once the whole body has gone out
+        response.call_on_close(lambda: log_request(stats, response.status_code))
+        return response
+    g.pop('sql_stats')
+    if current_app.config['SQL_SERVER_TIMING']:
+        response.headers.add('Server-Timing', stats.server_timing())
+    log_request(stats, response.status_code)
+    return response
+
+
+def init_app(app, engines):
+    # times every statement the engines run while the app serves a request. engines is called
+    # at the start of each request, as the app may replace its engines after init_app
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+    path = app.config['SQL_SLOW_QUERY_LOG'] and os.path.abspath(app.config['SQL_SLOW_QUERY_LOG'])
+    if path and not any(getattr(handler, 'baseFilename', None) == path for handler in slow_logger.handlers):
+        handler = logging.FileHandler(path)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        slow_logger.addHandler(handler)
+
+    def start_request():
+        for engine in engines():
+            instrument(engine)
+        config = current_app.config
+        g.sql_stats = RequestStats(request.method, request.path, config['SQL_SLOW_QUERY_MS'],
+                                   config['SQL_SLOWEST_STATEMENTS'])
+
+    app.before_request(start_request)
+    app.after_request(finish_request)
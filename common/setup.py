@@ -0,0 +1,10 @@
+from setuptools import setup
+
+# code shared by fyyur and the trivia API, installed into each app's environment by its
+# requirements.txt (pip install -e ../common)
+setup(
+    name='fsnd-common',
+    version='0.1.0',
+    packages=['fsnd_common'],
+    install_requires=['Flask', 'SQLAlchemy'],
+)
@@ -2,16 +2,27 @@
 # Imports
 # ----------------------------------------------------------------------------#
 
+import json
 import logging
-from itertools import groupby
+from functools import lru_cache
 from logging import Formatter, FileHandler
 
-import babel
+import babel.dates
+import click
 import dateutil.parser
-from flask import Flask, render_template, request, flash, redirect, url_for, jsonify
+from flask import Flask, Response, render_template, stream_template, request, flash, redirect, url_for, jsonify, \
+    abort
 from flask_migrate import Migrate
 from flask_moment import Moment
 
+import bulk_import
+import cache
+import counters
+import database
+import instrumentation
+import queries
+import routing
+import search
 from forms import *
 from models import db, Venue, Show, Artist
 
@@ -23,6 +34,7 @@ app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
 db.init_app(app)
+instrumentation.init_app(app)
 migrate = Migrate(app, db)
 
 
@@ -30,13 +42,25 @@ migrate = Migrate(app, db)
 # Filters.
 # ----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-    date = dateutil.parser.parse(value)
-    if format == 'full':
-        format = "EEEE MMMM, d, y 'at' h:mma"
-    elif format == 'medium':
-        format = "EE MM, dd, y h:mma"
-    return babel.dates.format_datetime(date, format, locale='en')
+DATETIME_FORMATS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma",
+}
+
+
+@lru_cache(maxsize=None)
+def datetime_pattern(format, locale):
+    # compiled babel pattern & locale, parsed once per format and locale
+    return babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format)), babel.Locale.parse(locale)
+
+
+@lru_cache(maxsize=4096)
+def format_datetime(value, format='medium', locale='en'):
+    # takes datetimes as they come from the database, strings are still parsed
+    if isinstance(value, str):
+        value = dateutil.parser.parse(value)
+    pattern, locale = datetime_pattern(format, locale)
+    return pattern.apply(value, locale)
 
 
 app.jinja_env.filters['datetime'] = format_datetime
@@ -55,65 +79,36 @@ def index():
 # #  ----------------------------------------------------------------
 #
 @app.route('/venues')
+@cache.cached('venues')
 def venues():
-    venues_query = Venue.query.all()
-    # grouped array
-    venues_grouped = []
-
-    # sort venues
-    sorted_venues = sorted(venues_query, key=lambda a: (a.city, a.state))
-    # group by city & state
-    grouped = [list(result) for key, result in groupby(sorted_venues, key=lambda a: (a.city, a.state))]
-    # create final object
-    for group in grouped:
-        venues_group = []
-        upcoming = 0
-
-        for venue in group:
-            # determine upcoming shows
-            for show in venue.shows:
-                # if start time greater than now
-                if show.start_time > datetime.today():
-                    # increase upcoming by 1
-                    upcoming += 1
-            # create venue object
-            data = {'id': venue.id, 'name': venue.name, 'num_upcoming_shows': upcoming}
-            # append to final object
-            venues_group.append(data)
-        # append new venue
-        venues_grouped.append({'city': group[0].city, 'state': group[0].state, 'venues': venues_group})
-
-    return render_template('pages/venues.html', areas=venues_grouped)
+    # city & state areas with per-venue upcoming show counts
+    areas = queries.venue_areas()
+
+    return render_template('pages/venues.html', areas=areas)
 
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
     # retrieve search term
     term = request.form['search_term']
-    # retrieve venue search result
-    venues_search = Venue.query.filter(Venue.name.ilike('%' + term + '%')).all()
+    # retrieve ranked venue search result
+    count, venues_search = search.get_backend(app.config.get('SEARCH_BACKEND')).search(Venue, term)
     response_venues = []
 
     # generate response object
     for venue in venues_search:
-        num_upcoming_shows = 0
-        # get upcoming shows
-        for venue_show in venue.shows:
-            if venue_show.start_time > datetime.today():
-                num_upcoming_shows += 1
-
         # prepare venue response
         data = {
             'id': venue.id,
             'name': venue.name,
-            'num_upcoming_shows': num_upcoming_shows
+            'num_upcoming_shows': venue.upcoming_shows_count
         }
 
         # append to response data field
         response_venues.append(data)
 
     response = {
-        "count": len(venues_search),
+        "count": count,
         "data": response_venues
     }
 
@@ -122,25 +117,20 @@ def search_venues():
 
 
 @app.route('/venues/<int:venue_id>')
+@cache.cached('venue:{venue_id}', 'venue-pages')
 def show_venue(venue_id):
     # shows the venue page with the given venue_id
     # retrieve venue
     venue = Venue.query.get(venue_id)
-    past_shows = []
-    upcoming_shows = []
-    # get venue shows
-    venue_shows = venue.shows
-
-    # iterate through venue shows
-    for show in venue_shows:
-        # set past show if start_time is past
-        if show.start_time < datetime.today():
-            past_shows.append({'artist_id': show.artist_id, 'artist_name': show.artist.name,
-                               'artist_image_link': show.artist.image_link, 'start_time': str(show.start_time)})
-        # set upcoming show if start_time future
-        else:
-            upcoming_shows.append({'artist_id': show.artist_id, 'artist_name': show.artist.name,
-                                   'artist_image_link': show.artist.image_link, 'start_time': str(show.start_time)})
+    # past & upcoming shows with their artists, past shows paginated
+    shows = queries.show_partition(Show.venue_id, venue_id, 'venue_shows',
+                                   past_page=max(request.args.get('past_page', 1, type=int), 1))
+    past_shows = [{'artist_id': show.artist_id, 'artist_name': show.artist.name,
+                   'artist_image_link': show.artist.image_link, 'start_time': show.start_time}
+                  for show in shows['past_shows']]
+    upcoming_shows = [{'artist_id': show.artist_id, 'artist_name': show.artist.name,
+                       'artist_image_link': show.artist.image_link, 'start_time': show.start_time}
+                      for show in shows['upcoming_shows']]
     data = {
         'id': venue.id,
         'name': venue.name,
@@ -156,8 +146,10 @@ def show_venue(venue_id):
         'image_link': venue.image_link,
         'past_shows': past_shows,
         'upcoming_shows': upcoming_shows,
-        "past_shows_count": len(past_shows),
-        "upcoming_shows_count": len(upcoming_shows),
+        "past_shows_count": shows['past_shows_count'],
+        "upcoming_shows_count": shows['upcoming_shows_count'],
+        "past_shows_page": shows['past_shows_page'],
+        "past_shows_pages": shows['past_shows_pages'],
     }
 
     return render_template('pages/show_venue.html', venue=data)
@@ -190,6 +182,7 @@ def create_venue_submission():
 
             db.session.add(venue)
             db.session.commit()
+            cache.invalidate('venues')
         else:
             error = True
     except:
@@ -214,6 +207,7 @@ def delete_venue(venue_id):
         Venue.query.filter_by(id=venue_id).delete()
         # make update to database
         db.session.commit()
+        cache.invalidate('venues', 'venue:{}'.format(venue_id), 'shows', 'artist-pages')
     except:
         error = True
         db.session.rollback()
@@ -228,41 +222,48 @@ def delete_venue(venue_id):
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@cache.cached('artists')
 def artists():
-    # query all artists
-    artists = Artist.query.with_entities(Artist.id, Artist.name).all()
+    # one page of artists, keyed on the last artist of the previous page or a letter to jump to
+    limit = min(max(request.args.get('limit', queries.ARTISTS_PER_PAGE, type=int), 1), queries.MAX_ARTISTS_PER_PAGE)
+    try:
+        page = queries.artist_page(after=request.args.get('after'), letter=request.args.get('letter'), limit=limit)
+    except ValueError:
+        abort(400)
 
-    return render_template('pages/artists.html', artists=artists)
+    # json variant for infinite scroll, no jump index
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'artists': [{'id': artist.id, 'name': artist.name} for artist in page['artists']],
+            'next_cursor': page['next_cursor']
+        })
+
+    return render_template('pages/artists.html', artists=page['artists'], next_cursor=page['next_cursor'],
+                           letters=queries.artist_letters())
 
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
     # retrieve search term
     term = request.form['search_term']
-    # retrieve venue search result
-    artists_search = Artist.query.filter(Artist.name.ilike('%' + term + '%')).all()
+    # retrieve ranked artist search result
+    count, artists_search = search.get_backend(app.config.get('SEARCH_BACKEND')).search(Artist, term)
     response_artists = []
 
     # generate response object
     for artist in artists_search:
-        num_upcoming_shows = 0
-        # get upcoming shows
-        for artist_show in artist.shows:
-            if artist_show.start_time > datetime.today():
-                num_upcoming_shows += 1
-
         # prepare venue response
         data = {
             'id': artist.id,
             'name': artist.name,
-            'num_upcoming_shows': num_upcoming_shows
+            'num_upcoming_shows': artist.upcoming_shows_count
         }
 
         # append to response data field
         response_artists.append(data)
 
     response = {
-        "count": len(artists_search),
+        "count": count,
         "data": response_artists
     }
     return render_template('pages/search_artists.html', results=response,
@@ -270,23 +271,19 @@ def search_artists():
 
 
 @app.route('/artists/<int:artist_id>')
+@cache.cached('artist:{artist_id}', 'artist-pages')
 def show_artist(artist_id):
     # shows the artist page with the given artist_id
     artist = Artist.query.get(artist_id)
-    shows = artist.shows
-    upcoming_shows = []
-    past_shows = []
-
-    # sort shows by date
-    for show in shows:
-        if show.start_time < datetime.today():
-            past_shows.append(
-                {'venue_id': show.venue_id, 'venue_name': show.venue.name, 'venue_image_link': show.venue.image_link,
-                 'start_time': str(show.start_time)})
-        else:
-            upcoming_shows.append(
-                {'venue_id': show.venue_id, 'venue_name': show.venue.name, 'venue_image_link': show.venue.image_link,
-                 'start_time': str(show.start_time)})
+    # past & upcoming shows with their venues, past shows paginated
+    shows = queries.show_partition(Show.artist_id, artist_id, 'artist_shows',
+                                   past_page=max(request.args.get('past_page', 1, type=int), 1))
+    past_shows = [{'venue_id': show.venue_id, 'venue_name': show.venue.name,
+                   'venue_image_link': show.venue.image_link, 'start_time': show.start_time}
+                  for show in shows['past_shows']]
+    upcoming_shows = [{'venue_id': show.venue_id, 'venue_name': show.venue.name,
+                       'venue_image_link': show.venue.image_link, 'start_time': show.start_time}
+                      for show in shows['upcoming_shows']]
 
     data = {
         'id': artist.id,
@@ -302,8 +299,10 @@ def show_artist(artist_id):
         'image_link': artist.image_link,
         'past_shows': past_shows,
         'upcoming_shows': upcoming_shows,
-        "past_shows_count": len(past_shows),
-        "upcoming_shows_count": len(upcoming_shows),
+        "past_shows_count": shows['past_shows_count'],
+        "upcoming_shows_count": shows['upcoming_shows_count'],
+        "past_shows_page": shows['past_shows_page'],
+        "past_shows_pages": shows['past_shows_pages'],
     }
 
     return render_template('pages/show_artist.html', artist=data)
@@ -342,6 +341,8 @@ def edit_artist_submission(artist_id):
 
         # commit updates
         db.session.commit()
+        # artist name & image appear on show listings and venue pages
+        cache.invalidate('artists', 'artist:{}'.format(artist_id), 'shows', 'venue-pages')
     except:
         error = True
         db.session.rollback()
@@ -383,6 +384,8 @@ def edit_venue_submission(venue_id):
 
         # Commit update
         db.session.commit()
+        # venue name & image appear on show listings and artist pages
+        cache.invalidate('venues', 'venue:{}'.format(venue_id), 'shows', 'artist-pages')
     except:
         error = False
         db.session.rollback()
@@ -413,6 +416,7 @@ def create_artist_submission():
                         seeking_description=form.seeking_description.data)
         db.session.add(artist)
         db.session.commit()
+        cache.invalidate('artists')
     except:
         error = True
         db.session.rollback()
@@ -430,18 +434,19 @@ def create_artist_submission():
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@cache.cached('shows')
 def shows():
     # displays list of shows at /shows
-    # retrieve shows
-    shows = Show.query.all()
-    data = []
-
-    for show in shows:
-        data.append({'venue_id': show.venue_id, 'venue_name': show.venue.name, 'artist_id': show.artist_id,
-                     'artist_name': show.artist.name, 'artist_image_link': show.artist.image_link,
-                     'start_time': str(show.start_time)})
+    # retrieve one page of shows, keyed on the last show of the previous page
+    try:
+        shows = queries.ShowListing(after=request.args.get('after'))
+    except ValueError:
+        abort(400)
 
-    return render_template('pages/shows.html', shows=data)
+    # streamed output sends the first rows before the whole page is rendered
+    if app.config.get('STREAM_SHOWS'):
+        return Response(stream_template('pages/shows.html', shows=shows))
+    return render_template('pages/shows.html', shows=shows)
 
 
 @app.route('/shows/create')
@@ -463,6 +468,8 @@ def create_show_submission():
         db.session.add(show)
         # add data to database
         db.session.commit()
+        cache.invalidate('shows', 'venues', 'venue:{}'.format(form.venue_id.data),
+                         'artist:{}'.format(form.artist_id.data))
     except:
         error = True
         db.session.rollback()
@@ -476,6 +483,26 @@ def create_show_submission():
     return render_template('pages/home.html')
 
 
+#  Monitoring
+#  ----------------------------------------------------------------
+
+@app.route('/cache/stats')
+def cache_stats():
+    # hit/miss/eviction counters of this worker's response cache
+    response_cache = cache.get_cache()
+    return jsonify(response_cache.stats() if response_cache is not None else {'backend': None})
+
+
+@app.route('/db/pool/stats')
+def db_pool_stats():
+    # connection pool checkout/wait counters of this worker, with the replicas' pools and health
+    stats = database.pool_stats(db.engine)
+    router = routing.get_router()
+    if router is not None:
+        stats['replicas'] = router.stats()
+    return jsonify(stats)
+
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -496,6 +523,40 @@ if not app.debug:
     app.logger.addHandler(file_handler)
     app.logger.info('errors')
 
+# ----------------------------------------------------------------------------#
+# Commands.
+# ----------------------------------------------------------------------------#
+
+@app.cli.command('roll-forward-shows')
+@click.option('--recount', is_flag=True, help='Rebuild the counters from the Show table.')
+def roll_forward_shows(recount):
+    """Take shows that have started off the upcoming show counters. Run periodically."""
+    if recount:
+        click.echo('{} upcoming shows counted'.format(counters.recount()))
+    else:
+        click.echo('{} shows rolled into the past'.format(counters.roll_forward()))
+
+
+@app.cli.command('bulk-import')
+@click.argument('kind', type=click.Choice(sorted(bulk_import.IMPORTS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--batch-size', default=bulk_import.BATCH_SIZE, show_default=True, help='Rows per INSERT and commit.')
+@click.option('--rejects', type=click.File('w'), help='Write rejected rows and their errors here as JSONL.')
+def bulk_import_command(kind, path, format, batch_size, rejects):
+    """Load venues, artists or shows from a CSV or JSONL file, validated with the web forms."""
+
+    def on_reject(number, row, errors):
+        if rejects is not None:
+            rejects.write(json.dumps({'line': number, 'errors': errors, 'row': row}, default=str) + '\n')
+        else:
+            click.echo('line {}: {}'.format(number, errors), err=True)
+
+    stats = bulk_import.load(kind, bulk_import.read_rows(path, format), batch_size, on_reject)
+    click.echo('{} {} loaded, {} rejected in {:.1f}s ({:.0f} rows/sec)'.format(
+        stats.loaded, kind, stats.rejected, stats.elapsed, stats.rows_per_second))
+
+
 # ----------------------------------------------------------------------------#
 # Launch.
 # ----------------------------------------------------------------------------#
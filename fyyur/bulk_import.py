@@ -0,0 +1,152 @@
+import csv
+import json
+import time
+
+from werkzeug.datastructures import MultiDict
+
+import cache
+import counters
+import search
+from forms import VenueForm, ArtistForm, ShowForm
+from models import db, Venue, Artist, Show
+
+BATCH_SIZE = 1000
+
+# form validating each kind of row, the model it loads into and the form fields it keeps
+IMPORTS = {
+    'venues': (VenueForm, Venue, ['name', 'city', 'state', 'address', 'phone', 'genres', 'image_link',
+                                  'facebook_link', 'website_link', 'seeking_talent', 'seeking_description']),
+    'artists': (ArtistForm, Artist, ['name', 'city', 'state', 'phone', 'genres', 'image_link', 'facebook_link',
+                                     'website_link', 'seeking_venue', 'seeking_description']),
+    'shows': (ShowForm, Show, ['start_time', 'artist_id', 'venue_id']),
+}
+
+# BooleanField reads any value it is sent as true, so these cells are sent as unchecked
+BOOLEAN_FIELDS = {'seeking_talent', 'seeking_venue'}
+FALSE_VALUES = {'', '0', 'false', 'f', 'no', 'n', 'off'}
+
+# cached pages that can list imported rows
+INVALIDATED_TAGS = ['venues', 'artists', 'shows', 'venue-pages', 'artist-pages']
+
+
+class ImportStats:
+    def __init__(self):
+        self.loaded = 0
+        self.rejected = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        return (self.loaded + self.rejected) / self.elapsed if self.elapsed else 0.0
+
+
+# Reading
+# ----------------------------------------------------------------
+
+def read_rows(path, format=None):
+    # yields (line number, row) pairs without loading the file; unparseable lines come back as None
+    format = format or ('csv' if path.endswith('.csv') else 'jsonl')
+    with open(path, newline='') as file:
+        if format == 'csv':
+            reader = csv.DictReader(file)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for number, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield number, json.loads(line)
+                except ValueError:
+                    yield number, None
+
+
+def to_formdata(row):
+    # shape a csv or json row the way the browser posts the form
+    data = MultiDict()
+    for key, value in row.items():
+        if isinstance(value, list):
+            data.setlist(key, [str(item) for item in value])
+        elif key == 'genres' and isinstance(value, str):
+            data.setlist(key, [genre.strip() for genre in value.split(',') if genre.strip()])
+        elif isinstance(value, bool) or key in BOOLEAN_FIELDS:
+            if value is not None and str(value).strip().lower() not in FALSE_VALUES:
+                data[key] = 'y'
+        elif value is not None:
+            data[key] = str(value)
+    return data
+
+
+# Loading
+# ----------------------------------------------------------------
+
+def validate(kind, row, known_ids):
+    # returns (values, errors) for one row using the same form rules as the web handlers
+    form_class, _, fields = IMPORTS[kind]
+    if not isinstance(row, dict):
+        return None, {'row': ['not a JSON object']}
+    # a form missing start_time falls back to its default, the time of the import
+    if kind == 'shows' and not str(row.get('start_time') or '').strip():
+        return None, {'start_time': ['This field is required.']}
+
+    form = form_class(formdata=to_formdata(row), meta={'csrf': False})
+    if not form.validate():
+        return None, form.errors
+
+    values = {field: getattr(form, field).data for field in fields}
+    if kind == 'shows':
+        errors = {}
+        for field in ('artist_id', 'venue_id'):
+            try:
+                values[field] = int(values[field])
+            except (TypeError, ValueError):
+                errors[field] = ['not an id']
+                continue
+            if values[field] not in known_ids[field]:
+                errors[field] = ['no such record']
+        if errors:
+            return None, errors
+    return values, None
+
+
+def load(kind, rows, batch_size=BATCH_SIZE, on_reject=None):
+    # validate and insert rows in batches, one multi-row INSERT and one commit per batch
+    _, model, _ = IMPORTS[kind]
+    known_ids = {}
+    if kind == 'shows':
+        known_ids = {'artist_id': {row.id for row in db.session.query(Artist.id)},
+                     'venue_id': {row.id for row in db.session.query(Venue.id)}}
+
+    stats = ImportStats()
+    batch = []
+    for number, row in rows:
+        values, errors = validate(kind, row, known_ids)
+        if errors:
+            stats.rejected += 1
+            if on_reject is not None:
+                on_reject(number, row, errors)
+            continue
+        batch.append(values)
+        if len(batch) >= batch_size:
+            flush(model, batch, stats)
+            batch = []
+    if batch:
+        flush(model, batch, stats)
+
+    # core inserts bypass the response cache and the search index events, and flush() keeps the counters
+    cache.invalidate(*INVALIDATED_TAGS)
+    search.invalidate(model)
+    return stats
+
+
+def flush(model, batch, stats):
+    db.session.execute(model.__table__.insert(), batch)
+    # core inserts bypass the counter events
+    if model is Show:
+        counters.add_imported(batch)
+    db.session.commit()
+    stats.loaded += len(batch)
@@ -0,0 +1,250 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, request, session, make_response
+
+import routing
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# key prefix of every store, so the tag generations of both stores agree
+PREFIX = 'fyyur:'
+
+
+# Stores
+# ----------------------------------------------------------------
+
+class LRUStore:
+    # in-process store bounded by entry count, entries expire after ttl seconds. tag generations
+    # are kept on generations_client, e.g. redis, when one is given, so a write in one worker
+    # invalidates the pages of every worker. without it a write reaches only its own worker and
+    # the others serve their pages until they expire, up to ttl seconds later
+    def __init__(self, max_entries=1024, ttl=60, generations_client=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.generations_client = generations_client
+        # generations live outside the LRU so they are never evicted
+        self.generations = {}
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                self.evictions += 1
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def generation(self, tag):
+        if self.generations_client is not None:
+            return int(self.generations_client.get(PREFIX + 'gen:' + tag) or 0)
+        return self.generations.get(tag, 0)
+
+    def bump(self, tag):
+        if self.generations_client is not None:
+            self.generations_client.incr(PREFIX + 'gen:' + tag)
+            return
+        with self.lock:
+            self.generations[tag] = self.generations.get(tag, 0) + 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.generations.clear()
+
+    def size(self):
+        return len(self.entries)
+
+
+class SharedStore:
+    # store on a server shared by every worker, e.g. redis. entries expire server-side,
+    # so evictions are not visible from here
+    def __init__(self, client, ttl=60, prefix=PREFIX):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.evictions = None
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, value, ex=self.ttl)
+
+    def generation(self, tag):
+        return int(self.client.get(self.prefix + 'gen:' + tag) or 0)
+
+    def bump(self, tag):
+        self.client.incr(self.prefix + 'gen:' + tag)
+
+    def clear(self):
+        self.client.flushdb()
+
+    def size(self):
+        return None
+
+
+class LocalClient:
+    # stand-in for a redis client when no server is configured
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        with self.lock:
+            value, expires = self.values.get(name, (None, None))
+            if expires is not None and expires < time.monotonic():
+                del self.values[name]
+                return None
+            return value
+
+    def set(self, name, value, ex=None):
+        with self.lock:
+            self.values[name] = (value, time.monotonic() + ex if ex else None)
+
+    def incr(self, name):
+        with self.lock:
+            value = int(self.values.get(name, (0, None))[0]) + 1
+            self.values[name] = (value, None)
+            return value
+
+    def flushdb(self):
+        with self.lock:
+            self.values.clear()
+
+
+# Response cache
+# ----------------------------------------------------------------
+
+class ResponseCache:
+    # rendered pages keyed by path and query string. every page carries tags, and
+    # invalidating a tag bumps its generation, which is part of the key, so stale
+    # pages are never looked up again and age out of the store
+    def __init__(self, store):
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def key(self, path, tags):
+        generations = ','.join('{}={}'.format(tag, self.store.generation(tag)) for tag in tags)
+        return '{}|{}'.format(path, generations)
+
+    def get(self, key):
+        value = self.store.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.store.set(key, value)
+
+    def invalidate(self, *tags):
+        for tag in tags:
+            self.store.bump(tag)
+        self.invalidations += len(tags)
+
+    def clear(self):
+        self.store.clear()
+
+    def stats(self):
+        return {
+            'backend': type(self.store).__name__,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.store.evictions,
+            'invalidations': self.invalidations,
+            'size': self.store.size(),
+        }
+
+
+def redis_client(config):
+    url = config.get('CACHE_REDIS_URL')
+    return redis.Redis.from_url(url) if url and redis is not None else None
+
+
+def create_cache(config):
+    backend = config.get('CACHE_BACKEND')
+    ttl = config.get('CACHE_TTL', 60)
+    if backend == 'lru':
+        # with redis the generations are shared, so a write in any worker or in a CLI command
+        # (bulk-import, roll-forward-shows) invalidates the pages every worker holds
+        generations_client = redis_client(config)
+        if generations_client is None and config.get('CACHE_WORKERS', 1) > 1:
+            logger.warning('%s workers without CACHE_REDIS_URL: a write invalidates cached pages in its '
+                           'own worker only, the others serve theirs for up to %ss',
+                           config['CACHE_WORKERS'], ttl)
+        return ResponseCache(LRUStore(config.get('CACHE_MAX_ENTRIES', 1024), ttl, generations_client))
+    if backend == 'shared':
+        return ResponseCache(SharedStore(redis_client(config) or LocalClient(), ttl))
+    return None
+
+
+def get_cache():
+    # one cache per app, built from its config on first use
+    if 'response_cache' not in current_app.extensions:
+        current_app.extensions['response_cache'] = create_cache(current_app.config)
+    return current_app.extensions['response_cache']
+
+
+def invalidate(*tags):
+    response_cache = get_cache()
+    if response_cache is not None:
+        response_cache.invalidate(*tags)
+
+
+# Views
+# ----------------------------------------------------------------
+
+def cached(*tags):
+    # cache a GET view's rendered page. tags may name view arguments, e.g. 'venue:{venue_id}'
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            response_cache = get_cache()
+            # pages with pending flash messages are personal, never serve or store them. neither
+            # are pages read from the primary by a client that just wrote, as other clients'
+            # pages come from the replicas and may not show its write yet
+            if response_cache is None or request.method != 'GET' or session.get('_flashes') or routing.sticky():
+                return view(**kwargs)
+
+            key = response_cache.key(request.full_path, [tag.format(**kwargs) for tag in tags])
+            cached_value = response_cache.get(key)
+            if cached_value is not None:
+                # stored as '<content type>\n<body>' so every store can hold it as bytes
+                content_type, body = cached_value.split(b'\n', 1)
+                return make_response(body, 200, {'Content-Type': content_type.decode()})
+
+            response = make_response(view(**kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                response_cache.set(key, response.content_type.encode() + b'\n' + response.get_data())
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,113 @@
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import and_, bindparam, event, func, select
+
+import cache
+from models import db, Venue, Artist, Show, CounterCheckpoint
+
+# show column pointing at each model that keeps an upcoming_shows_count
+COUNTED = ((Show.venue_id, Venue), (Show.artist_id, Artist))
+
+
+# Checkpoint
+# ----------------------------------------------------------------
+
+@event.listens_for(CounterCheckpoint.__table__, 'after_create')
+def create_checkpoint(table, connection, **kw):
+    # tables created outside migrations start out empty, so counting starts now
+    connection.execute(table.insert().values(id=1, rolled_forward_at=datetime.today()))
+
+
+def checkpoint_time(connection):
+    # shared lock, so a roll forward cannot move the checkpoint under a show write
+    rolled_forward_at = connection.execute(
+        select(CounterCheckpoint.rolled_forward_at).with_for_update(read=True)).scalar()
+    return rolled_forward_at or datetime.today()
+
+
+# Show writes
+# ----------------------------------------------------------------
+
+def adjust(connection, show, delta):
+    # only shows after the checkpoint are counted; the next roll forward takes them off again
+    if show.start_time is None or show.start_time <= checkpoint_time(connection):
+        return
+    for column, model in COUNTED:
+        connection.execute(model.__table__.update()
+                           .where(model.id == getattr(show, column.key))
+                           .values(upcoming_shows_count=model.upcoming_shows_count + delta))
+
+
+@event.listens_for(Show, 'after_insert')
+def show_inserted(mapper, connection, target):
+    adjust(connection, target, 1)
+
+
+@event.listens_for(Show, 'after_delete')
+def show_deleted(mapper, connection, target):
+    adjust(connection, target, -1)
+
+
+def add_imported(shows):
+    # adjust() for a batch of show rows inserted in bulk: one grouped UPDATE per counted model,
+    # in the batch's transaction, so the import never rescans the Show table
+    checkpoint = checkpoint_time(db.session.connection())
+    upcoming = [show for show in shows if show['start_time'] > checkpoint]
+    for column, model in COUNTED:
+        added = Counter(show[column.key] for show in upcoming)
+        if added:
+            db.session.execute(model.__table__.update()
+                               .where(model.id == bindparam('counted_id'))
+                               .values(upcoming_shows_count=model.upcoming_shows_count + bindparam('added')),
+                               [{'counted_id': counted_id, 'added': count} for counted_id, count in added.items()])
+
+
+# Maintenance
+# ----------------------------------------------------------------
+
+def roll_forward(now=None):
+    # move the checkpoint to now, taking shows that started in between off the counters
+    now = now or datetime.today()
+    checkpoint = CounterCheckpoint.query.with_for_update().first()
+    if checkpoint is None:
+        recount(now)
+        return 0
+    if now <= checkpoint.rolled_forward_at:
+        return 0
+
+    window = and_(Show.start_time > checkpoint.rolled_forward_at, Show.start_time <= now)
+    for column, model in COUNTED:
+        passed = db.session.query(column.label('id'), func.count(Show.id).label('passed')) \
+            .filter(window) \
+            .group_by(column) \
+            .subquery()
+        db.session.execute(model.__table__.update()
+                           .where(model.id == passed.c.id)
+                           .values(upcoming_shows_count=model.upcoming_shows_count - passed.c.passed))
+    total = db.session.query(func.count(Show.id)).filter(window).scalar()
+
+    checkpoint.rolled_forward_at = now
+    db.session.commit()
+    # the /venues page shows the counters
+    if total:
+        cache.invalidate('venues')
+    return total
+
+
+def recount(now=None):
+    # rebuild every counter from the Show table, e.g. after bulk loads that bypass the ORM
+    now = now or datetime.today()
+    checkpoint = CounterCheckpoint.query.with_for_update().first()
+    if checkpoint is None:
+        checkpoint = CounterCheckpoint(id=1, rolled_forward_at=now)
+        db.session.add(checkpoint)
+
+    for column, model in COUNTED:
+        upcoming = select(func.count(Show.id)).where(column == model.id, Show.start_time > now).scalar_subquery()
+        db.session.execute(model.__table__.update().values(upcoming_shows_count=upcoming))
+
+    checkpoint.rolled_forward_at = now
+    db.session.commit()
+    cache.invalidate('venues')
+    return db.session.query(func.count(Show.id)).filter(Show.start_time > now).scalar()
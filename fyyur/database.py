@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+
+
+# Pools
+# ----------------------------------------------------------------
+
+class PoolMetrics:
+    # checkout counts and wait times, read by /db/pool/stats to size workers
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def waited(self, seconds):
+        with self.lock:
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+
+class InstrumentedPoolMixin:
+    # SET LOCAL statement_timeout on every checkout, for PgBouncer in transaction mode,
+    # which rejects the startup option. set by engine_options
+    local_statement_timeout = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+        for name, listener in self.listeners():
+            event.listen(self, name, listener)
+
+    def listeners(self):
+        listeners = [('connect', self._on_connect), ('invalidate', self._on_invalidate)]
+        if self.local_statement_timeout:
+            listeners.append(('checkout', self._on_checkout))
+        return listeners
+
+    def recreate(self):
+        # the recreated pool is handed the listeners of this one, which count into the metrics
+        # it inherits, so it drops its own
+        pool = super().recreate()
+        for name, listener in pool.listeners():
+            event.remove(pool, name, listener)
+        pool.metrics = self.metrics
+        return pool
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except TimeoutError:
+            with self.metrics.lock:
+                self.metrics.timeouts += 1
+            raise
+        self.metrics.waited(time.perf_counter() - started)
+        return connection
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self.metrics.lock:
+            self.metrics.connects += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        # stale connections found by pre-ping or a failed statement, e.g. after a failover
+        with self.metrics.lock:
+            self.metrics.invalidations += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('SET LOCAL statement_timeout = {:d}'.format(self.local_statement_timeout))
+        cursor.close()
+
+    def stats(self):
+        metrics = self.metrics
+        return {
+            'pool': type(self).__name__,
+            'size': self.size() if isinstance(self, QueuePool) else None,
+            'checked_out': self.checkedout() if isinstance(self, QueuePool) else None,
+            'overflow': self.overflow() if isinstance(self, QueuePool) else None,
+            'checkouts': metrics.checkouts,
+            'timeouts': metrics.timeouts,
+            'connects': metrics.connects,
+            'invalidations': metrics.invalidations,
+            'wait_avg_ms': 1000 * metrics.wait_total / metrics.checkouts if metrics.checkouts else 0.0,
+            'wait_max_ms': 1000 * metrics.wait_max,
+        }
+
+
+class InstrumentedQueuePool(InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedNullPool(InstrumentedPoolMixin, NullPool):
+    pass
+
+
+# Engine options
+# ----------------------------------------------------------------
+
+def env_flag(env, name, default):
+    value = env.get(name)
+    return default if value is None else value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def engine_options(env=os.environ):
+    # create_engine keyword arguments for SQLALCHEMY_ENGINE_OPTIONS, read from the environment
+    pgbouncer = env_flag(env, 'DB_PGBOUNCER', False)
+    statement_timeout = int(env.get('DB_STATEMENT_TIMEOUT_MS', 0))
+    options = {'pool_pre_ping': env_flag(env, 'DB_POOL_PRE_PING', True)}
+
+    if pgbouncer:
+        # PgBouncer in transaction mode does the pooling, so hold no connections here
+        pool_class = InstrumentedNullPool
+        if statement_timeout:
+            pool_class = type('InstrumentedNullPool', (InstrumentedNullPool,),
+                              {'local_statement_timeout': statement_timeout})
+        options['poolclass'] = pool_class
+    else:
+        options.update({
+            'poolclass': InstrumentedQueuePool,
+            'pool_size': int(env.get('DB_POOL_SIZE', 5)),
+            'max_overflow': int(env.get('DB_MAX_OVERFLOW', 10)),
+            'pool_timeout': float(env.get('DB_POOL_TIMEOUT', 30)),
+            'pool_recycle': int(env.get('DB_POOL_RECYCLE', 1800)),
+        })
+        if statement_timeout:
+            options['connect_args'] = {'options': '-c statement_timeout={:d}'.format(statement_timeout)}
+
+    return options
+
+
+def pool_stats(engine):
+    pool = engine.pool
+    return pool.stats() if isinstance(pool, InstrumentedPoolMixin) else {'pool': type(pool).__name__}
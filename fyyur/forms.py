@@ -15,7 +15,7 @@ class ShowForm(Form):
     start_time = DateTimeField(
         'start_time',
         validators=[DataRequired()],
-        default=datetime.today()
+        default=datetime.today
     )
 
 
@@ -88,7 +88,7 @@ class VenueForm(Form):
     phone = StringField(
         'phone',
         validators=[DataRequired(), Regexp(regex='[0-9]{3}-[0-9]{3}-[0-9]{4}$', message='Invalid Phone Number'),
-                    Length(min=10, max=10)]
+                    Length(min=12, max=12)]
     )
     image_link = StringField(
         'image_link'
@@ -199,7 +199,7 @@ class ArtistForm(Form):
         # TODO implement validation logic for phone
         'phone',
         validators=[DataRequired(), Regexp(regex='[0-9]{3}-[0-9]{3}-[0-9]{4}$', message='Invalid Phone Number'),
-                    Length(min=10, max=10)]
+                    Length(min=12, max=12)]
     )
 
     image_link = StringField(
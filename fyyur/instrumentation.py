@@ -0,0 +1,17 @@
+from fsnd_common import sql_instrumentation
+
+import routing
+from models import db
+
+# the instrumentation itself is fsnd_common.sql_instrumentation (common/), shared with the trivia API
+
+
+def engines():
+    # the primary, and the replicas GET requests read from
+    router = routing.get_router()
+    return [db.engine] + ([replica.engine for replica in router.replicas] if router is not None else [])
+
+
+def init_app(app):
+    # query count & database time per request, see sql_instrumentation.DEFAULTS for the SQL_* settings
+    sql_instrumentation.init_app(app, engines)
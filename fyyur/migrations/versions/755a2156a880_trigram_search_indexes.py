@@ -0,0 +1,31 @@
+"""trigram search indexes
+
+Revision ID: 755a2156a880
+Revises: 0dbdada565ad
+Create Date: 2026-10-18 10:02:13.419877
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '755a2156a880'
+down_revision = '0dbdada565ad'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # GIN trigram indexes serve ILIKE '%term%' and similarity() ranking for venue & artist search.
+    # they are not declared on the models, see include_object in env.py
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_Venue_name_trgm', 'Venue', ['name'], unique=False, postgresql_using='gin',
+                    postgresql_ops={'name': 'gin_trgm_ops'})
+    op.create_index('ix_Artist_name_trgm', 'Artist', ['name'], unique=False, postgresql_using='gin',
+                    postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade():
+    op.drop_index('ix_Artist_name_trgm', table_name='Artist')
+    op.drop_index('ix_Venue_name_trgm', table_name='Venue')
@@ -1,6 +1,7 @@
-from flask_sqlalchemy import SQLAlchemy
+from routing import RoutingSQLAlchemy
 
-db = SQLAlchemy()
+# GET requests read from the replicas in SQLALCHEMY_REPLICA_URIS when there are any, see routing.py
+db = RoutingSQLAlchemy()
 
 
 # Venue Model
@@ -19,12 +20,18 @@ class Venue(db.Model):
     website_link = db.Column(db.String(120))
     seeking_talent = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String)
+    # shows starting after the last counter roll forward, maintained by counters.py
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     shows = db.relationship('Show', backref='venue', cascade='all,delete')
 
 
 # Artist Model
 class Artist(db.Model):
     __tablename__ = 'Artist'
+    # keyset pagination of the artist directory
+    __table_args__ = (
+        db.Index('ix_Artist_name_id', 'name', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -37,14 +44,30 @@ class Artist(db.Model):
     website_link = db.Column(db.String(120))
     seeking_venue = db.Column(db.Boolean, default=False)
     seeking_description = db.Column(db.String)
+    # shows starting after the last counter roll forward, maintained by counters.py
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     shows = db.relationship('Show', backref='artist', cascade='all,delete')
 
 
 # Show Model
 class Show(db.Model):
     __tablename__ = 'Show'
+    # past / upcoming lookups per venue and per artist are range scans on these
+    __table_args__ = (
+        db.Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    start_time = db.Column(db.DateTime)
+    start_time = db.Column(db.DateTime, index=True)
     artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
     venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
+
+
+# Counter Checkpoint Model
+class CounterCheckpoint(db.Model):
+    __tablename__ = 'CounterCheckpoint'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # upcoming_shows_count covers shows starting after this time
+    rolled_forward_at = db.Column(db.DateTime, nullable=False)
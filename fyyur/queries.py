@@ -0,0 +1,169 @@
+from datetime import datetime
+from itertools import groupby
+
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import joinedload
+
+from models import db, Venue, Show, Artist
+
+UPCOMING_SHOWS_LIMIT = 50
+PAST_SHOWS_PER_PAGE = 10
+SHOWS_PER_PAGE = 60
+ARTISTS_PER_PAGE = 100
+MAX_ARTISTS_PER_PAGE = 500
+
+
+# Loader profiles
+# ----------------------------------------------------------------
+
+# eager-loading options per page, so a list of shows costs a fixed number of statements
+# however many rows it holds. built lazily because the Show.venue / Show.artist
+# backrefs only exist once the mappers are configured
+LOADER_PROFILES = {
+    'venue_shows': lambda: [joinedload(Show.artist)],
+    'artist_shows': lambda: [joinedload(Show.venue)],
+}
+
+
+def with_profile(query, name):
+    return query.options(*LOADER_PROFILES[name]())
+
+
+# Venues
+# ----------------------------------------------------------------
+
+def venue_areas():
+    # upcoming show counts come from the counter column, so the Show table is not touched
+    rows = db.session.query(Venue.id, Venue.name, Venue.city, Venue.state,
+                            Venue.upcoming_shows_count.label('num_upcoming_shows')) \
+        .order_by(Venue.city, Venue.state, Venue.id) \
+        .all()
+
+    # rows arrive sorted by city & state, so grouping is a single pass
+    areas = []
+    for (city, state), group in groupby(rows, key=lambda row: (row.city, row.state)):
+        areas.append({
+            'city': city,
+            'state': state,
+            'venues': [{'id': row.id, 'name': row.name, 'num_upcoming_shows': row.num_upcoming_shows}
+                       for row in group]
+        })
+
+    return areas
+
+
+# Artists
+# ----------------------------------------------------------------
+
+def encode_artist_cursor(name, artist_id):
+    return '{}_{}'.format(artist_id, name)
+
+
+def decode_artist_cursor(cursor):
+    # raises ValueError on a malformed cursor
+    artist_id, name = cursor.split('_', 1)
+    return name, int(artist_id)
+
+
+def artist_page(after=None, letter=None, limit=ARTISTS_PER_PAGE):
+    # one keyset page of artists ordered by (name, id), served by the (name, id) index.
+    # letter jumps to the first artist whose name sorts at or after it
+    query = db.session.query(Artist.id, Artist.name)
+    if after:
+        query = query.filter(tuple_(Artist.name, Artist.id) > decode_artist_cursor(after))
+    elif letter:
+        query = query.filter(Artist.name >= letter)
+    # one extra row tells whether there is a next page
+    rows = query.order_by(Artist.name, Artist.id).limit(limit + 1).all()
+
+    next_cursor = encode_artist_cursor(rows[limit - 1].name, rows[limit - 1].id) if len(rows) > limit else None
+    return {'artists': rows[:limit], 'next_cursor': next_cursor}
+
+
+def artist_letters():
+    # A-Z jump index with artist counts from one grouped query, anything else under '#'
+    rows = db.session.query(func.upper(func.substr(Artist.name, 1, 1)).label('letter'),
+                            func.count(Artist.id).label('count')) \
+        .group_by('letter') \
+        .all()
+
+    letters = {}
+    for row in rows:
+        letter = row.letter if row.letter and 'A' <= row.letter <= 'Z' else '#'
+        letters[letter] = letters.get(letter, 0) + row.count
+    return sorted(letters.items())
+
+
+# Shows
+# ----------------------------------------------------------------
+
+def show_partition(column, value, profile, past_page=1):
+    # counts, upcoming shows and one page of past shows for a venue or artist,
+    # each a bounded range scan on the (venue_id, start_time) / (artist_id, start_time) index
+    now = datetime.today()
+    counts = db.session.query(func.count(Show.id).filter(Show.start_time > now).label('upcoming'),
+                              func.count(Show.id).filter(Show.start_time <= now).label('past')) \
+        .filter(column == value) \
+        .one()
+    upcoming_shows = with_profile(Show.query, profile) \
+        .filter(column == value, Show.start_time > now) \
+        .order_by(Show.start_time, Show.id) \
+        .limit(UPCOMING_SHOWS_LIMIT) \
+        .all()
+    # most recent past shows first
+    past_shows = with_profile(Show.query, profile) \
+        .filter(column == value, Show.start_time <= now) \
+        .order_by(Show.start_time.desc(), Show.id.desc()) \
+        .offset((past_page - 1) * PAST_SHOWS_PER_PAGE) \
+        .limit(PAST_SHOWS_PER_PAGE) \
+        .all()
+
+    return {
+        'upcoming_shows': upcoming_shows,
+        'past_shows': past_shows,
+        'upcoming_shows_count': counts.upcoming,
+        'past_shows_count': counts.past,
+        'past_shows_page': past_page,
+        'past_shows_pages': -(-counts.past // PAST_SHOWS_PER_PAGE),
+    }
+
+
+def encode_show_cursor(start_time, show_id):
+    return '{}_{}'.format(show_id, start_time.isoformat())
+
+
+def decode_show_cursor(cursor):
+    # raises ValueError on a malformed cursor
+    show_id, start_time = cursor.split('_', 1)
+    return datetime.fromisoformat(start_time), int(show_id)
+
+
+class ShowListing:
+    # one keyset page of the show listing ordered by (start_time, id), with venue and
+    # artist names joined in. rows are fetched while iterating so the template can be
+    # streamed; next_cursor is set once the page has been consumed
+    def __init__(self, after=None, limit=SHOWS_PER_PAGE):
+        self.limit = limit
+        self.next_cursor = None
+        query = db.session.query(Show.id, Show.start_time, Show.venue_id, Venue.name.label('venue_name'),
+                                 Show.artist_id, Artist.name.label('artist_name'),
+                                 Artist.image_link.label('artist_image_link')) \
+            .join(Venue, Show.venue_id == Venue.id) \
+            .join(Artist, Show.artist_id == Artist.id)
+        # shows without a start time have no place in the listing's order, nor a cursor
+        query = query.filter(Show.start_time.isnot(None))
+        if after:
+            query = query.filter(tuple_(Show.start_time, Show.id) > decode_show_cursor(after))
+        # one extra row tells whether there is a next page
+        self.query = query.order_by(Show.start_time, Show.id).limit(limit + 1)
+
+    def __iter__(self):
+        last = None
+        for count, row in enumerate(self.query.yield_per(100)):
+            if count == self.limit:
+                self.next_cursor = encode_show_cursor(last.start_time, last.id)
+                break
+            last = row
+            yield {'venue_id': row.venue_id, 'venue_name': row.venue_name, 'artist_id': row.artist_id,
+                   'artist_name': row.artist_name, 'artist_image_link': row.artist_image_link,
+                   'start_time': row.start_time}
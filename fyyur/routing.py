@@ -0,0 +1,157 @@
+import itertools
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, event, orm, text
+from sqlalchemy.exc import DBAPIError
+
+import database
+
+# cookie holding the time until which a client that just wrote reads from the primary
+STICKY_COOKIE = 'fyyur_primary_until'
+READ_METHODS = ('GET', 'HEAD')
+
+
+# Replicas
+# ----------------------------------------------------------------
+
+class Replica:
+    def __init__(self, engine):
+        self.engine = engine
+        self.healthy = True
+        self.checked_at = None
+
+    def check(self):
+        try:
+            with self.engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+            self.healthy = True
+        except DBAPIError:
+            self.healthy = False
+        self.checked_at = time.monotonic()
+        return self.healthy
+
+    def is_healthy(self, interval):
+        # checked on first use and again once the last check is older than interval seconds
+        if self.checked_at is None or time.monotonic() - self.checked_at >= interval:
+            self.check()
+        return self.healthy
+
+
+class ReplicaRouter:
+    # round-robin over the replicas, skipping any that failed their last health check
+    def __init__(self, urls, engine_options=None, health_interval=5):
+        self.replicas = [Replica(create_engine(url, **(engine_options or {}))) for url in urls]
+        self.health_interval = health_interval
+        self.position = itertools.count()
+        self.lock = threading.Lock()
+
+    def pick(self):
+        # returns a replica engine, or None when every replica is down
+        for _ in range(len(self.replicas)):
+            with self.lock:
+                replica = self.replicas[next(self.position) % len(self.replicas)]
+            if replica.is_healthy(self.health_interval):
+                return replica.engine
+        return None
+
+    def stats(self):
+        return [dict(database.pool_stats(replica.engine), url=repr(replica.engine.url), healthy=replica.healthy)
+                for replica in self.replicas]
+
+    def dispose(self):
+        for replica in self.replicas:
+            replica.engine.dispose()
+
+
+def create_router(config):
+    urls = config.get('SQLALCHEMY_REPLICA_URIS')
+    if not urls:
+        return None
+    return ReplicaRouter(urls, config.get('SQLALCHEMY_ENGINE_OPTIONS'), config.get('REPLICA_HEALTH_INTERVAL', 5))
+
+
+def get_router(app=None):
+    # one router per app, built from its config on first use
+    app = app or current_app
+    if 'replica_router' not in app.extensions:
+        app.extensions['replica_router'] = create_router(app.config)
+    return app.extensions['replica_router']
+
+
+# Request routing
+# ----------------------------------------------------------------
+
+def sticky():
+    # a client that wrote in the last REPLICA_STICKY_SECONDS reads its own writes from the primary
+    if g.get('wrote'):
+        return True
+    try:
+        return float(request.cookies.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def replica_engine(app):
+    # the replica serving this request, picked once so a request never spans two replicas
+    if not has_request_context() or request.method not in READ_METHODS or sticky():
+        return None
+    if 'replica_engine' not in g:
+        router = get_router(app)
+        g.replica_engine = router.pick() if router is not None else None
+    return g.replica_engine
+
+
+def mark_write():
+    if has_request_context():
+        g.wrote = True
+
+
+def reset():
+    # g outlives the request when an app context was pushed around it, e.g. in tests
+    g.pop('wrote', None)
+    g.pop('replica_engine', None)
+
+
+def set_sticky_cookie(response):
+    if g.get('wrote'):
+        seconds = current_app.config.get('REPLICA_STICKY_SECONDS', 10)
+        response.set_cookie(STICKY_COOKIE, '{:.0f}'.format(time.time() + seconds), max_age=seconds, httponly=True)
+    return response
+
+
+# Session
+# ----------------------------------------------------------------
+
+class RoutingSession(SignallingSession):
+    # reads in GET requests go to a replica, everything else, and every flush, to the primary
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing:
+            engine = replica_engine(self.app)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def flushed(session, flush_context):
+    mark_write()
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def executed(orm_execute_state):
+    # bulk updates & deletes and core statements skip the flush
+    if not orm_execute_state.is_select:
+        mark_write()
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def init_app(self, app):
+        super().init_app(app)
+        app.before_request(reset)
+        app.after_request(set_sticky_cookie)
@@ -0,0 +1,109 @@
+import weakref
+
+from sqlalchemy import event, func
+
+from models import db, Venue, Artist
+
+SEARCH_RESULTS_LIMIT = 50
+
+
+# Backends
+# ----------------------------------------------------------------
+
+class TrigramSearch:
+    # case-insensitive substring match served by the pg_trgm GIN indexes on name,
+    # best matches first
+    def search(self, model, term, limit=SEARCH_RESULTS_LIMIT):
+        query = model.query.filter(model.name.ilike('%' + escape_like(term) + '%', escape='\\'))
+        results = query.order_by(func.similarity(model.name, term).desc(), model.id).limit(limit).all()
+        # the page is full, so ask the database for the real number of matches
+        count = query.count() if len(results) == limit else len(results)
+        return count, results
+
+
+class MemorySearch:
+    # in-process trigram index for databases without pg_trgm (e.g. SQLite test runs).
+    # built lazily per model and dropped whenever a row of that model is written. writes
+    # are only seen from this process, so the backend is for single-process deployments
+    def __init__(self):
+        self.indexes = {}
+        live.add(self)
+
+    def build(self, model):
+        names = {}
+        postings = {}
+        for row in db.session.query(model.id, model.name):
+            name = (row.name or '').lower()
+            names[row.id] = name
+            for trigram in trigrams(name):
+                postings.setdefault(trigram, set()).add(row.id)
+        return names, postings
+
+    def search(self, model, term, limit=SEARCH_RESULTS_LIMIT):
+        if model not in self.indexes:
+            self.indexes[model] = self.build(model)
+        names, postings = self.indexes[model]
+        term = term.lower()
+
+        # every trigram of the term must occur in the name; short terms fall back to a scan
+        term_trigrams = trigrams(term)
+        if term_trigrams:
+            candidates = set.intersection(*(postings.get(trigram, set()) for trigram in term_trigrams))
+        else:
+            candidates = names.keys()
+        matches = [match_id for match_id in candidates if term in names[match_id]]
+
+        # rank exact and prefix matches first, then shorter names
+        matches.sort(key=lambda match_id: (names[match_id] != term, not names[match_id].startswith(term),
+                                           len(names[match_id]), match_id))
+        ids = matches[:limit]
+        rows = {row.id: row for row in model.query.filter(model.id.in_(ids))} if ids else {}
+        return len(matches), [rows[match_id] for match_id in ids if match_id in rows]
+
+
+# memory backends holding indexes, dropped with the last reference to them
+live = weakref.WeakSet()
+
+
+def invalidate(*models):
+    # drop the in-memory indexes of models, e.g. after core inserts the ORM events miss
+    for backend in list(live):
+        for model in models:
+            backend.indexes.pop(model, None)
+
+
+def invalidate_written(mapper, connection, target):
+    invalidate(mapper.class_)
+
+
+for model in (Venue, Artist):
+    for name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(model, name, invalidate_written)
+
+
+BACKENDS = {
+    'trigram': TrigramSearch,
+    'memory': MemorySearch,
+}
+
+_backends = {}
+
+
+def get_backend(name=None):
+    # SEARCH_BACKEND picks a backend explicitly, otherwise it follows the database
+    if name is None:
+        name = 'trigram' if db.engine.dialect.name == 'postgresql' else 'memory'
+    if name not in _backends:
+        _backends[name] = BACKENDS[name]()
+    return _backends[name]
+
+
+# Helpers
+# ----------------------------------------------------------------
+
+def escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
@@ -0,0 +1,631 @@
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+import babel.dates
+import flask
+from fsnd_common.benchmarking import QueryCounter
+
+import cache
+import counters
+import database
+import queries
+import routing
+import search
+from app import app, format_datetime
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from models import db, Venue, Artist, Show
+
+
+class FyyurTestCase(unittest.TestCase):
+    """This class represents the fyyur test case"""
+
+    def setUp(self):
+        """Define test variables and initialize app."""
+        self.database_name = "fyyur_test"
+        self.database_path = 'postgresql://{}:{}@{}/{}'.format(os.environ.get('DB_TEST_USER'),
+                                                               os.environ.get('DB_TEST_PASSWORD'),
+                                                               os.environ.get('DB_TEST_HOST'), self.database_name)
+        app.config['SQLALCHEMY_DATABASE_URI'] = self.database_path
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['SEARCH_BACKEND'] = 'memory'
+        app.config['CACHE_BACKEND'] = None
+        app.config['SQLALCHEMY_REPLICA_URIS'] = []
+        app.extensions.pop('response_cache', None)
+        app.extensions.pop('replica_router', None)
+        self.client = app.test_client
+
+        # binds the app to the current context
+        self.context = app.app_context()
+        self.context.push()
+        # create all tables
+        db.create_all()
+
+    def tearDown(self):
+        """Executed after reach test"""
+        db.session.remove()
+        db.drop_all()
+        search._backends.clear()
+        self.context.pop()
+
+    def add_venue(self, name, city='San Francisco', state='CA'):
+        venue = Venue(name=name, city=city, state=state, genres=['Jazz'])
+        db.session.add(venue)
+        db.session.commit()
+        return venue
+
+    def add_artist(self, name):
+        artist = Artist(name=name, city='San Francisco', state='CA', genres=['Jazz'])
+        db.session.add(artist)
+        db.session.commit()
+        return artist
+
+    def add_show(self, venue, artist, days):
+        show = Show(venue_id=venue.id, artist_id=artist.id, start_time=datetime.today() + timedelta(days=days))
+        db.session.add(show)
+        db.session.commit()
+        return show
+
+    def assertMaxQueries(self, limit, func):
+        """Run func with a fresh session and fail if it issues more than limit statements."""
+        db.session.expunge_all()
+        with QueryCounter(db.engine) as counter:
+            func()
+        self.assertLessEqual(counter.count, limit, '{} statements issued, expected at most {}'.format(
+            counter.count, limit))
+
+    def test_venue_areas_counts_upcoming_shows_per_venue(self):
+        busy = self.add_venue('Busy Venue')
+        quiet = self.add_venue('Quiet Venue')
+        artist = self.add_artist('Artist')
+        self.add_show(busy, artist, 10)
+        self.add_show(busy, artist, 20)
+        self.add_show(busy, artist, -10)
+        self.add_show(quiet, artist, -10)
+
+        areas = queries.venue_areas()
+
+        self.assertEqual(len(areas), 1)
+        counts = {venue['name']: venue['num_upcoming_shows'] for venue in areas[0]['venues']}
+        self.assertEqual(counts, {'Busy Venue': 2, 'Quiet Venue': 0})
+
+    def test_venue_areas_groups_by_city_and_state(self):
+        self.add_venue('Venue 1', city='New York', state='NY')
+        self.add_venue('Venue 2', city='San Francisco', state='CA')
+        self.add_venue('Venue 3', city='New York', state='NY')
+
+        areas = queries.venue_areas()
+
+        self.assertEqual([(area['city'], area['state']) for area in areas],
+                         [('New York', 'NY'), ('San Francisco', 'CA')])
+        self.assertEqual([venue['name'] for venue in areas[0]['venues']], ['Venue 1', 'Venue 3'])
+
+    def test_get_venues(self):
+        self.add_venue('Venue 1')
+        res = self.client().get('/venues')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'Venue 1', res.data)
+
+    def test_venue_areas_query_count(self):
+        artist = self.add_artist('Artist')
+        for i in range(5):
+            self.add_show(self.add_venue('Venue {}'.format(i)), artist, 10)
+
+        self.assertMaxQueries(1, queries.venue_areas)
+
+    def test_show_venue_query_count(self):
+        venue = self.add_venue('Venue 1')
+        for i in range(5):
+            self.add_show(venue, self.add_artist('Artist {}'.format(i)), 10 - 5 * i)
+        venue_id = venue.id
+
+        res = self.client().get('/venues/{}'.format(venue_id))
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'Artist 4', res.data)
+        self.assertMaxQueries(4, lambda: self.client().get('/venues/{}'.format(venue_id)))
+
+    def test_show_artist_query_count(self):
+        artist = self.add_artist('Artist 1')
+        for i in range(5):
+            self.add_show(self.add_venue('Venue {}'.format(i)), artist, 10 - 5 * i)
+        artist_id = artist.id
+
+        res = self.client().get('/artists/{}'.format(artist_id))
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'Venue 4', res.data)
+        self.assertMaxQueries(4, lambda: self.client().get('/artists/{}'.format(artist_id)))
+
+    def test_show_partition_paginates_past_shows(self):
+        venue = self.add_venue('Venue 1')
+        artist = self.add_artist('Artist 1')
+        for i in range(15):
+            self.add_show(venue, artist, -1 - i)
+        self.add_show(venue, artist, 10)
+
+        first = queries.show_partition(Show.venue_id, venue.id, 'venue_shows')
+        second = queries.show_partition(Show.venue_id, venue.id, 'venue_shows', past_page=2)
+
+        self.assertEqual(first['past_shows_count'], 15)
+        self.assertEqual(first['upcoming_shows_count'], 1)
+        self.assertEqual(first['past_shows_pages'], 2)
+        self.assertEqual(len(first['past_shows']), queries.PAST_SHOWS_PER_PAGE)
+        self.assertEqual(len(second['past_shows']), 5)
+        # most recent past show first
+        self.assertGreater(first['past_shows'][0].start_time, second['past_shows'][0].start_time)
+
+    def test_show_listing_keyset_pages(self):
+        venue = self.add_venue('Venue 1')
+        artist = self.add_artist('Artist 1')
+        for i in range(7):
+            self.add_show(venue, artist, i)
+
+        seen = []
+        cursor = None
+        while True:
+            page = queries.ShowListing(after=cursor, limit=3)
+            rows = list(page)
+            seen.extend(row['start_time'] for row in rows)
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(seen, sorted(seen))
+
+    def test_show_listing_skips_shows_without_start_time(self):
+        venue = self.add_venue('Venue 1')
+        artist = self.add_artist('Artist 1')
+        for i in range(3):
+            self.add_show(venue, artist, i)
+        db.session.add(Show(venue_id=venue.id, artist_id=artist.id, start_time=None))
+        db.session.commit()
+
+        page = queries.ShowListing(limit=2)
+        rows = list(page) + list(queries.ShowListing(after=page.next_cursor, limit=2))
+
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(self.client().get('/shows').status_code, 200)
+
+    def test_get_shows_streamed(self):
+        self.add_show(self.add_venue('Venue 1'), self.add_artist('Artist 1'), 1)
+        app.config['STREAM_SHOWS'] = True
+        try:
+            res = self.client().get('/shows')
+            body = res.get_data()
+        finally:
+            app.config['STREAM_SHOWS'] = False
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'Artist 1', body)
+        self.assertIn(b'Venue 1', body)
+
+    def test_400_get_shows_bad_cursor(self):
+        res = self.client().get('/shows?after=bogus')
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_memory_search_ranks_and_limits(self):
+        for name in ['The Jazz Club', 'Jazz', 'Jazz Bar', 'Blues Hall']:
+            self.add_venue(name)
+        backend = search.get_backend('memory')
+
+        count, results = backend.search(Venue, 'jazz', limit=2)
+
+        self.assertEqual(count, 3)
+        self.assertEqual([venue.name for venue in results], ['Jazz', 'Jazz Bar'])
+
+    def test_memory_search_sees_new_rows(self):
+        self.add_venue('Jazz Bar')
+        backend = search.get_backend('memory')
+        self.assertEqual(backend.search(Venue, 'ja')[0], 1)
+
+        self.add_venue('Jazz Club')
+
+        self.assertEqual(backend.search(Venue, 'ja')[0], 2)
+
+    def test_memory_search_sees_bulk_imported_rows(self):
+        self.add_artist('Jazz Trio')
+        backend = search.get_backend('memory')
+        self.assertEqual(backend.search(Artist, 'ja')[0], 1)
+        path = self.write_file('.csv', 'name,city,state,phone,genres,facebook_link\n'
+                                       'Jazz Duo,San Francisco,CA,123-123-1234,Jazz,https://facebook.com/a1\n')
+
+        app.test_cli_runner().invoke(args=['bulk-import', 'artists', path])
+
+        self.assertEqual(backend.search(Artist, 'ja')[0], 2)
+
+    def test_search_artists(self):
+        self.add_artist('Guns N Petals')
+        self.add_artist('Matt Quevedo')
+        res = self.client().post('/artists/search', data={'search_term': 'petal'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'Guns N Petals', res.data)
+        self.assertNotIn(b'Matt Quevedo', res.data)
+
+    def test_upcoming_counter_follows_show_writes(self):
+        venue = self.add_venue('Venue 1')
+        artist = self.add_artist('Artist 1')
+        show = self.add_show(venue, artist, 10)
+        self.add_show(venue, artist, -10)
+
+        self.assertEqual(Venue.query.get(venue.id).upcoming_shows_count, 1)
+        self.assertEqual(Artist.query.get(artist.id).upcoming_shows_count, 1)
+
+        db.session.delete(show)
+        db.session.commit()
+
+        self.assertEqual(Venue.query.get(venue.id).upcoming_shows_count, 0)
+        self.assertEqual(Artist.query.get(artist.id).upcoming_shows_count, 0)
+
+    def test_roll_forward_takes_started_shows_off_counters(self):
+        venue = self.add_venue('Venue 1')
+        artist = self.add_artist('Artist 1')
+        self.add_show(venue, artist, 10)
+        self.add_show(venue, artist, 20)
+
+        passed = counters.roll_forward(now=datetime.today() + timedelta(days=15))
+
+        self.assertEqual(passed, 1)
+        self.assertEqual(Venue.query.get(venue.id).upcoming_shows_count, 1)
+        self.assertEqual(Artist.query.get(artist.id).upcoming_shows_count, 1)
+        # a show starting before the checkpoint is not counted
+        self.add_show(venue, artist, 12)
+        self.assertEqual(Venue.query.get(venue.id).upcoming_shows_count, 1)
+
+    def test_recount_rebuilds_counters(self):
+        venue = self.add_venue('Venue 1')
+        artist = self.add_artist('Artist 1')
+        self.add_show(venue, artist, 10)
+        Venue.query.filter_by(id=venue.id).update({'upcoming_shows_count': 42})
+        db.session.commit()
+
+        self.assertEqual(counters.recount(), 1)
+        self.assertEqual(Venue.query.get(venue.id).upcoming_shows_count, 1)
+
+    def enable_cache(self, backend='lru'):
+        app.config['CACHE_BACKEND'] = backend
+        app.extensions.pop('response_cache', None)
+
+    def test_cached_page_invalidated_by_create(self):
+        self.enable_cache()
+        self.add_artist('Artist 1')
+        self.assertIn(b'Artist 1', self.client().get('/artists').data)
+
+        # written behind the cache's back, so the cached page is served
+        self.add_artist('Artist 2')
+        self.assertNotIn(b'Artist 2', self.client().get('/artists').data)
+
+        self.client().post('/artists/create', data={'name': 'Artist 3', 'city': 'San Francisco', 'state': 'CA',
+                                                    'phone': '123-123-1234', 'genres': ['Jazz'],
+                                                    'facebook_link': 'https://www.facebook.com/artist3'})
+        res = self.client().get('/artists')
+
+        self.assertIn(b'Artist 2', res.data)
+        self.assertIn(b'Artist 3', res.data)
+        stats = self.client().get('/cache/stats').get_json()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+
+    def test_shared_cache_invalidated_by_edit(self):
+        self.enable_cache('shared')
+        artist = self.add_artist('Artist 1')
+        artist_id = artist.id
+        self.assertIn(b'Artist 1', self.client().get('/artists/{}'.format(artist_id)).data)
+
+        self.client().post('/artists/{}/edit'.format(artist_id),
+                           data={'name': 'Renamed Artist', 'city': 'San Francisco', 'state': 'CA',
+                                 'phone': '123-123-1234', 'genres': ['Jazz']})
+
+        self.assertIn(b'Renamed Artist', self.client().get('/artists/{}'.format(artist_id)).data)
+
+    def test_lru_store_bounds_size_and_age(self):
+        store = cache.LRUStore(max_entries=2, ttl=60)
+        store.set('a', 1)
+        store.set('b', 2)
+        store.get('a')
+        store.set('c', 3)
+
+        self.assertEqual(store.get('b'), None)
+        self.assertEqual(store.get('a'), 1)
+        self.assertEqual(store.evictions, 1)
+
+        expired = cache.LRUStore(ttl=-1)
+        expired.set('a', 1)
+        self.assertEqual(expired.get('a'), None)
+        self.assertEqual(expired.evictions, 1)
+
+    def test_lru_stores_share_generations_client(self):
+        client = cache.LocalClient()
+        worker_1 = cache.ResponseCache(cache.LRUStore(generations_client=client))
+        worker_2 = cache.ResponseCache(cache.LRUStore(generations_client=client))
+        key = worker_2.key('/venues', ['venues'])
+        worker_2.set(key, b'page')
+
+        worker_1.invalidate('venues')
+
+        self.assertNotEqual(worker_2.key('/venues', ['venues']), key)
+
+    def test_lru_store_uses_redis_generations_in_one_worker(self):
+        client = cache.LocalClient()
+        config = {'CACHE_BACKEND': 'lru', 'CACHE_REDIS_URL': 'redis://cache', 'CACHE_WORKERS': 1}
+
+        with mock.patch.object(cache, 'redis_client', return_value=client):
+            response_cache = cache.create_cache(config)
+
+        self.assertIs(response_cache.store.generations_client, client)
+
+    def test_lru_store_warns_without_redis_for_several_workers(self):
+        with self.assertLogs(cache.logger, 'WARNING'):
+            response_cache = cache.create_cache({'CACHE_BACKEND': 'lru', 'CACHE_WORKERS': 4})
+
+        self.assertIsNone(response_cache.store.generations_client)
+
+    def test_roll_forward_invalidates_venues_page(self):
+        self.enable_cache()
+        venue = self.add_venue('Venue 1')
+        self.add_show(venue, self.add_artist('Artist 1'), 10)
+        self.client().get('/venues')
+
+        counters.roll_forward(now=datetime.today() + timedelta(days=15))
+        self.client().get('/venues')
+
+        self.assertEqual(self.client().get('/cache/stats').get_json()['hits'], 0)
+
+    def test_format_datetime_matches_babel(self):
+        value = datetime(2019, 5, 21, 21, 30)
+        for format, pattern in [('full', "EEEE MMMM, d, y 'at' h:mma"), ('medium', "EE MM, dd, y h:mma")]:
+            expected = babel.dates.format_datetime(value, pattern, locale='en')
+            self.assertEqual(format_datetime(value, format), expected)
+            self.assertEqual(format_datetime(str(value), format), expected)
+
+    def enable_replica(self):
+        """Route reads to the fyyur_test_replica database, which nothing replicates into."""
+        replica_path = self.database_path.rsplit('/', 1)[0] + '/fyyur_test_replica'
+        app.config['SQLALCHEMY_REPLICA_URIS'] = [replica_path]
+        replica = routing.get_router(app).replicas[0].engine
+        db.metadata.create_all(replica)
+        self.addCleanup(replica.dispose)
+        self.addCleanup(db.metadata.drop_all, replica)
+        return replica
+
+    def write_file(self, suffix, content):
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(handle, 'w') as file:
+            file.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_bulk_import_artists_csv(self):
+        path = self.write_file('.csv', 'name,city,state,phone,genres,facebook_link\n'
+                                       'Artist 1,San Francisco,CA,123-123-1234,"Jazz,Blues",https://facebook.com/a1\n'
+                                       'Artist 2,San Francisco,CA,1234,Jazz,https://facebook.com/a2\n'
+                                       'Artist 3,New York,NY,123-123-1234,Jazz,https://facebook.com/a3\n')
+
+        result = app.test_cli_runner().invoke(args=['bulk-import', 'artists', path, '--batch-size', '1'])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('2 artists loaded, 1 rejected', result.output)
+        self.assertEqual(sorted(artist.name for artist in Artist.query.all()), ['Artist 1', 'Artist 3'])
+        self.assertEqual(Artist.query.filter_by(name='Artist 1').one().genres, ['Jazz', 'Blues'])
+
+    def test_bulk_import_reads_false_csv_cells_as_unchecked(self):
+        path = self.write_file('.csv', 'name,city,state,phone,genres,facebook_link,seeking_venue\n'
+                                       'Artist 1,San Francisco,CA,123-123-1234,Jazz,https://facebook.com/a1,False\n'
+                                       'Artist 2,San Francisco,CA,123-123-1234,Jazz,https://facebook.com/a2,0\n'
+                                       'Artist 3,San Francisco,CA,123-123-1234,Jazz,https://facebook.com/a3,True\n')
+
+        result = app.test_cli_runner().invoke(args=['bulk-import', 'artists', path])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual({artist.name: artist.seeking_venue for artist in Artist.query.all()},
+                         {'Artist 1': False, 'Artist 2': False, 'Artist 3': True})
+
+    def test_bulk_import_rejects_shows_without_start_time(self):
+        venue = self.add_venue('Venue 1')
+        artist = self.add_artist('Artist 1')
+        rows = [{'venue_id': venue.id, 'artist_id': artist.id},
+                {'venue_id': venue.id, 'artist_id': artist.id, 'start_time': ''}]
+        path = self.write_file('.jsonl', '\n'.join(json.dumps(row) for row in rows) + '\n')
+
+        result = app.test_cli_runner().invoke(args=['bulk-import', 'shows', path])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('0 shows loaded, 2 rejected', result.output)
+        self.assertEqual(Show.query.count(), 0)
+
+    def test_bulk_import_shows_jsonl(self):
+        venue = self.add_venue('Venue 1')
+        artist = self.add_artist('Artist 1')
+        start_time = (datetime.today() + timedelta(days=3)).strftime('%Y-%m-%d %H:%M:%S')
+        rows = [{'venue_id': venue.id, 'artist_id': artist.id, 'start_time': start_time},
+                {'venue_id': 1000, 'artist_id': artist.id, 'start_time': start_time},
+                {'venue_id': venue.id, 'artist_id': artist.id, 'start_time': 'tomorrow'}]
+        path = self.write_file('.jsonl', '\n'.join(json.dumps(row) for row in rows) + '\nnot json\n')
+        rejects = self.write_file('.jsonl', '')
+
+        result = app.test_cli_runner().invoke(args=['bulk-import', 'shows', path, '--rejects', rejects])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('1 shows loaded, 3 rejected', result.output)
+        with open(rejects) as file:
+            self.assertEqual([json.loads(line)['line'] for line in file], [2, 3, 4])
+        # counters are bumped for the loaded batch
+        self.assertEqual(Venue.query.get(venue.id).upcoming_shows_count, 1)
+        self.assertEqual(Artist.query.get(artist.id).upcoming_shows_count, 1)
+
+    def test_bulk_import_shows_counts_only_upcoming(self):
+        venue = self.add_venue('Venue 1')
+        artist = self.add_artist('Artist 1')
+        self.add_show(venue, artist, 10)
+        rows = [{'venue_id': venue.id, 'artist_id': artist.id,
+                 'start_time': (datetime.today() + timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')}
+                for days in (-3, 2, 5)]
+        path = self.write_file('.jsonl', '\n'.join(json.dumps(row) for row in rows) + '\n')
+
+        result = app.test_cli_runner().invoke(args=['bulk-import', 'shows', path, '--batch-size', '2'])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(Venue.query.get(venue.id).upcoming_shows_count, 3)
+        self.assertEqual(Artist.query.get(artist.id).upcoming_shows_count, 3)
+
+    def test_artist_directory_pages_and_letters(self):
+        for name in ['Bob', 'Alice', 'Carol', 'Anna', '2Pac']:
+            self.add_artist(name)
+
+        first = queries.artist_page(limit=2)
+        second = queries.artist_page(after=first['next_cursor'], limit=2)
+        jumped = queries.artist_page(letter='B', limit=2)
+
+        self.assertEqual([artist.name for artist in first['artists']], ['2Pac', 'Alice'])
+        self.assertEqual([artist.name for artist in second['artists']], ['Anna', 'Bob'])
+        self.assertEqual([artist.name for artist in jumped['artists']], ['Bob', 'Carol'])
+        self.assertIsNone(jumped['next_cursor'])
+        self.assertEqual(queries.artist_letters(), [('#', 1), ('A', 2), ('B', 1), ('C', 1)])
+
+    def test_get_artists_json(self):
+        for i in range(3):
+            self.add_artist('Artist {}'.format(i))
+
+        data = self.client().get('/artists?format=json&limit=2').get_json()
+        rest = self.client().get('/artists?format=json&limit=2&after={}'.format(data['next_cursor'])).get_json()
+
+        self.assertEqual([artist['name'] for artist in data['artists']], ['Artist 0', 'Artist 1'])
+        self.assertEqual([artist['name'] for artist in rest['artists']], ['Artist 2'])
+        self.assertIsNone(rest['next_cursor'])
+
+    def test_engine_options_from_environment(self):
+        options = database.engine_options({'DB_POOL_SIZE': '3', 'DB_POOL_PRE_PING': 'false'})
+        pgbouncer = database.engine_options({'DB_PGBOUNCER': '1', 'DB_STATEMENT_TIMEOUT_MS': '250'})
+
+        self.assertEqual(options['pool_size'], 3)
+        self.assertFalse(options['pool_pre_ping'])
+        self.assertIs(options['poolclass'], database.InstrumentedQueuePool)
+        self.assertTrue(issubclass(pgbouncer['poolclass'], database.InstrumentedNullPool))
+        self.assertEqual(pgbouncer['poolclass'].local_statement_timeout, 250)
+        self.assertNotIn('pool_size', pgbouncer)
+
+    def test_statement_timeout(self):
+        for env in ({'DB_STATEMENT_TIMEOUT_MS': '10'}, {'DB_PGBOUNCER': '1', 'DB_STATEMENT_TIMEOUT_MS': '10'}):
+            engine = create_engine(self.database_path, **database.engine_options(env))
+            with engine.connect() as connection:
+                with self.assertRaises(OperationalError):
+                    connection.execute(text('SELECT pg_sleep(1)'))
+            engine.dispose()
+
+    def test_db_pool_stats(self):
+        self.add_venue('Venue 1')
+        self.client().get('/venues')
+        stats = self.client().get('/db/pool/stats').get_json()
+
+        self.assertEqual(stats['pool'], 'InstrumentedQueuePool')
+        self.assertGreater(stats['checkouts'], 0)
+        self.assertGreaterEqual(stats['connects'], 1)
+
+    def test_recreated_pool_counts_into_the_same_metrics_once(self):
+        engine = create_engine(self.database_path, **database.engine_options({}))
+        engine.connect().close()
+        metrics = engine.pool.metrics
+
+        engine.dispose()
+        engine.connect().close()
+
+        self.assertIs(engine.pool.metrics, metrics)
+        self.assertEqual(metrics.connects, 2)
+        engine.dispose()
+
+    def test_get_requests_read_from_the_replica(self):
+        self.enable_replica()
+        self.add_venue('Primary Venue')
+
+        self.assertNotIn(b'Primary Venue', self.client().get('/venues').data)
+        # posted searches read from the primary
+        self.assertIn(b'Primary Venue', self.client().post('/venues/search', data={'search_term': 'primary'}).data)
+
+    def test_client_reads_its_own_writes_after_create(self):
+        self.enable_replica()
+        client = self.client()
+        res = client.post('/artists/create', data={'name': 'New Artist', 'city': 'San Francisco', 'state': 'CA',
+                                                   'phone': '123-123-1234', 'genres': ['Jazz'],
+                                                   'facebook_link': 'https://www.facebook.com/newartist'})
+
+        self.assertIn(routing.STICKY_COOKIE, res.headers.get('Set-Cookie', ''))
+        self.assertIn(b'New Artist', client.get('/artists').data)
+        # other clients keep reading from the replica
+        self.assertNotIn(b'New Artist', self.client().get('/artists').data)
+
+    def test_sticky_reads_bypass_the_response_cache(self):
+        self.enable_replica()
+        self.enable_cache()
+        writer = self.client()
+        writer.post('/artists/create', data={'name': 'New Artist', 'city': 'San Francisco', 'state': 'CA',
+                                             'phone': '123-123-1234', 'genres': ['Jazz'],
+                                             'facebook_link': 'https://www.facebook.com/newartist'})
+        # another client caches the replica's page, which lacks the write
+        self.assertNotIn(b'New Artist', self.client().get('/artists').data)
+
+        self.assertIn(b'New Artist', writer.get('/artists').data)
+        # the sticky read left the replica's page in the cache
+        self.assertNotIn(b'New Artist', self.client().get('/artists').data)
+        self.assertEqual(self.client().get('/cache/stats').get_json()['hits'], 1)
+
+    def test_replica_router_skips_unhealthy_replicas(self):
+        replica_path = self.database_path.rsplit('/', 1)[0] + '/fyyur_test_replica'
+        router = routing.ReplicaRouter([self.database_path.rsplit('/', 1)[0] + '/no_such_database',
+                                        replica_path, replica_path])
+        self.addCleanup(router.dispose)
+        picked = [router.pick() for _ in range(4)]
+
+        self.assertNotIn(router.replicas[0].engine, picked)
+        self.assertEqual({router.replicas[1].engine, router.replicas[2].engine}, set(picked))
+        self.assertEqual([False, True, True], [replica['healthy'] for replica in router.stats()])
+
+    def test_server_timing_reports_request_queries(self):
+        venue = self.add_venue('Venue 1')
+        res = self.client().get('/venues/{}'.format(venue.id))
+
+        timing = res.headers['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertNotIn('desc="0 queries"', timing)
+
+    def test_request_and_slow_query_logs(self):
+        venue = self.add_venue('Venue 1')
+        app.config['SQL_SLOW_QUERY_MS'] = 0
+        self.addCleanup(app.config.__setitem__, 'SQL_SLOW_QUERY_MS', 100)
+
+        with self.assertLogs('sql.requests', 'INFO') as requests_log, self.assertLogs('sql.slow') as slow_log:
+            self.client().get('/venues/{}'.format(venue.id))
+
+        summary = json.loads(requests_log.records[0].getMessage())
+        self.assertEqual(summary['path'], '/venues/{}'.format(venue.id))
+        self.assertEqual(summary['queries'], len(slow_log.records))
+        self.assertLessEqual(len(summary['slowest']), app.config['SQL_SLOWEST_STATEMENTS'])
+        self.assertIn('SELECT', json.loads(slow_log.records[0].getMessage())['statement'])
+
+    def test_instrumentation_times_app_engines_only(self):
+        other_engine = create_engine(self.database_path)
+        self.addCleanup(other_engine.dispose)
+        with app.test_request_context('/venues'):
+            app.preprocess_request()
+            with self.assertRaises(Exception):
+                db.session.execute(text('SELECT no_such_column FROM "Venue"'))
+            db.session.rollback()
+            db.session.execute(text('SELECT 1'))
+            with other_engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+            stats = flask.g.sql_stats
+
+        # the failed statement and the one after it, not the other engine's
+        self.assertEqual(stats.queries, 2)
+        self.assertEqual(sorted(statement for _, statement in stats.slowest)[0], 'SELECT 1')
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -1,31 +1,133 @@
-import random
+import io
+import os
+import time
 
 from dotenv import load_dotenv
-from flask import Flask, request, abort, jsonify
+from flask import Flask, Response, request, abort, jsonify, stream_with_context
 from flask_cors import CORS
+from flask_migrate import Migrate
+from sqlalchemy import func, select, tuple_
 
-from backend.models import setup_db, Question, Category
+from backend.models import db, setup_db, Question
+from . import bulk, caching, instrumentation, search, serialization
+from .categories import CATEGORY_VERSION_CHECK, CategoryCache
+from .quiz import QUESTION_INDEX_TTL, QUIZ_SESSION_TTL, MemorySessionStore, QuestionIndex, QuizSession
+from .serialization import question_rows
 
 load_dotenv()
 QUESTIONS_PER_PAGE = 10
-
-
-def paginate_questions(req, results):
-    page = req.args.get("page", 1, type=int)
-    start = (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
-    results = sorted(results, key=lambda x: x.category)
-
-    questions = [question.format() for question in results]
-    paginated_questions = questions[start:end]
-
-    return paginated_questions
+# seconds GET /questions reuses its total before counting the table again
+QUESTION_COUNT_TTL = 10
+# rejected rows POST /questions/bulk lists in its response, the rest are only counted
+MAX_REPORTED_REJECTS = 100
+
+
+class QuestionCount:
+    # COUNT(*) reads the whole table, so the total is kept while the questions table version
+    # stays the same, or without a version for a few seconds, and dropped whenever this worker
+    # adds or deletes a question
+    def __init__(self, ttl=QUESTION_COUNT_TTL):
+        self.ttl = ttl
+        self.value = None
+        self.version = None
+        self.expires = 0
+
+    def stale(self, version):
+        if self.value is None or version != self.version:
+            return True
+        return version is None and time.monotonic() >= self.expires
+
+    def store(self, value, version):
+        self.value, self.version = value, version
+        self.expires = time.monotonic() + self.ttl
+        return value
+
+    def get(self, version=None):
+        if self.stale(version):
+            return self.store(db.session.query(func.count(Question.id)).scalar(), version)
+        return self.value
+
+    async def get_async(self, connection, version=None):
+        if self.stale(version):
+            return self.store((await connection.execute(select(func.count(Question.id)))).scalar(), version)
+        return self.value
+
+    def reset(self):
+        self.value = None
+
+
+def encode_question_cursor(question):
+    # the (category, id) a page ends on, for ?after= to continue from
+    return '{}_{}'.format('' if question['category'] is None else question['category'], question['id'])
+
+
+def decode_question_cursor(cursor):
+    category, _, question_id = cursor.rpartition('_')
+    return int(category) if category else None, int(question_id)
+
+
+def page_statements(query, args):
+    # (page, top_up) for one page of the query in category, id order, built the same on a Query
+    # or a select(). top_up, when not None, is the query for questions without a category that
+    # fill a short page. ?after=<cursor> seeks past the cursor's row on the (category, id) index,
+    # where ?page= has the database skip every earlier row. page is None past the first page
+    query = query.order_by(None).order_by(Question.category.asc().nullslast(), Question.id)
+    after = args.get("after")
+    if not after:
+        page = args.get("page", 1, type=int)
+        if page < 1:
+            return None, None
+        return query.offset((page - 1) * QUESTIONS_PER_PAGE).limit(QUESTIONS_PER_PAGE), None
+
+    try:
+        category, question_id = decode_question_cursor(after)
+    except ValueError:
+        abort(400)
+    if category is None:
+        return query.filter(Question.category.is_(None), Question.id > question_id).limit(QUESTIONS_PER_PAGE), None
+    # a row comparison the index can seek on; questions without a category sort last
+    return query.filter(tuple_(Question.category, Question.id) > (category, question_id)) \
+        .limit(QUESTIONS_PER_PAGE), query.filter(Question.category.is_(None))
+
+
+def paginate_questions(req, query):
+    # one page of the query as Question.format() dicts
+    page, top_up = page_statements(query, req.args)
+    if page is None:
+        return []
+    questions = question_rows(page)
+    if top_up is not None and len(questions) < QUESTIONS_PER_PAGE:
+        questions += question_rows(top_up.limit(QUESTIONS_PER_PAGE - len(questions)))
+    return questions
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+    if test_config:
+        app.config.update(test_config)
+    if test_config and 'SQLALCHEMY_DATABASE_URI' in test_config:
+        setup_db(app, test_config['SQLALCHEMY_DATABASE_URI'])
+    else:
+        setup_db(app)
+    Migrate(app, db, directory=os.path.join(os.path.dirname(os.path.dirname(__file__)), 'migrations'))
+    # flask questions import / export
+    app.cli.add_command(bulk.questions_cli)
+    # query count & database time per request, see instrumentation.py
+    instrumentation.init_app(app)
+    # orjson for jsonify when installed, and gzip/brotli by Accept-Encoding, see serialization.py
+    serialization.init_app(app)
+    # ETag, Last-Modified and Cache-Control on the read endpoints, see caching.py for CACHE_CONTROL
+    caching.init_app(app)
+    question_count = QuestionCount(app.config.get('QUESTION_COUNT_TTL', QUESTION_COUNT_TTL))
+    category_cache = CategoryCache(app.config.get('CATEGORY_VERSION_CHECK', CATEGORY_VERSION_CHECK))
+    question_index = QuestionIndex(app.config.get('QUESTION_INDEX_TTL', QUESTION_INDEX_TTL))
+    # QUIZ_SESSION_STORE swaps in a store shared by the workers, see quiz.MemorySessionStore
+    quiz_sessions = app.config.get('QUIZ_SESSION_STORE') or \
+        MemorySessionStore(app.config.get('QUIZ_SESSION_TTL', QUIZ_SESSION_TTL))
+    # shared with the async read endpoints, see asgi.py, so this app's writes reach their caches
+    app.extensions['trivia'] = {'question_count': question_count, 'category_cache': category_cache,
+                                'question_index': question_index}
 
     """
     @TODO: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
@@ -49,16 +151,9 @@ def create_app(test_config=None):
     """
 
     @app.route('/categories')
+    @caching.conditional('categories')
     def retrieve_categories():
-        results = Category.query.order_by(Category.id).all()
-
-        if results is None:
-            abort(404)
-
-        categories = {}
-        for result in results:
-            category = result.format()
-            categories[category['id']] = category['type']
+        categories = category_cache.get(caching.request_version('categories'))
 
         return jsonify({"categories": categories})
 
@@ -77,19 +172,22 @@ def create_app(test_config=None):
     """
 
     @app.route('/questions')
+    @caching.conditional('questions', 'categories')
     def retrieve_questions():
-        results = Question.query.order_by(Question.id).all()
-        questions = paginate_questions(request, results)
-        categories = Category.query.order_by(Category.id).all()
+        questions = paginate_questions(request, Question.query)
 
         if len(questions) == 0:
             abort(404)
 
+        total_questions = question_count.get(caching.request_version('questions'))
+        categories = category_cache.get(caching.request_version('categories'))
+
         return jsonify({
             "questions": questions,
-            "total_questions": len(results),
-            "categories": {category.id: category.type for category in categories},
-            "current_category": None
+            "total_questions": total_questions,
+            "categories": categories,
+            "current_category": None,
+            "next_cursor": encode_question_cursor(questions[-1]) if len(questions) == QUESTIONS_PER_PAGE else None
         })
 
     """
@@ -108,7 +206,10 @@ def create_app(test_config=None):
             if question is None:
                 abort(404)
 
+            category = question.category
             question.delete()
+            question_count.reset()
+            question_index.removed(question_id, category)
 
             return jsonify({
                 "success": True,
@@ -140,13 +241,13 @@ def create_app(test_config=None):
 
         try:
             if search_term:
-                search_results = Question.query.order_by(Question.id).filter(
-                    Question.question.ilike("%{}%".format(search_term)))
-                results = paginate_questions(request, search_results)
+                # kept for older clients, POST /questions/search is the search endpoint
+                results, total = search.search_questions(search_term, request.args.get("page", 1, type=int),
+                                                         QUESTIONS_PER_PAGE)
 
                 return jsonify({
                     "questions": results,
-                    "totalQuestions": len(results),
+                    "totalQuestions": total,
                     "currentCategory": None
                 })
 
@@ -154,6 +255,8 @@ def create_app(test_config=None):
                 question = Question(question=new_question, answer=new_answer, category=new_category,
                                     difficulty=new_difficulty)
                 question.insert()
+                question_count.reset()
+                question_index.added(question.id, new_category)
 
                 return jsonify({
                     "success": True,
@@ -173,6 +276,54 @@ def create_app(test_config=None):
     Try using the word "title" to start.
     """
 
+    @app.route('/questions/search', methods=['POST'])
+    def search_questions():
+        body = request.get_json(silent=True) or {}
+        search_term = (body.get("searchTerm") or "").strip()
+
+        if not search_term:
+            abort(400)
+
+        results, total = search.search_questions(search_term, request.args.get("page", 1, type=int),
+                                                 QUESTIONS_PER_PAGE)
+
+        return jsonify({
+            "success": True,
+            "questions": results,
+            "total_questions": total,
+            "current_category": None
+        })
+
+    @app.route('/questions/bulk', methods=['POST'])
+    def import_questions():
+        # the body is read a line at a time, so a bank of any size is never held in memory
+        format = request.args.get("format") or bulk.format_for(request.mimetype)
+        if format not in bulk.FORMATS:
+            abort(400)
+
+        rejects = []
+
+        def on_reject(number, row, errors):
+            if len(rejects) < MAX_REPORTED_REJECTS:
+                rejects.append({"line": number, "errors": errors})
+
+        stream = io.TextIOWrapper(request.stream, encoding=request.mimetype_params.get("charset", "utf-8"),
+                                  newline="")
+        stats = bulk.load(bulk.read_rows(stream, format), on_reject=on_reject)
+        question_count.reset()
+        question_index.expire()
+
+        return jsonify(dict(stats.format(), success=True, rejects=rejects))
+
+    @app.route('/questions/bulk')
+    def export_questions():
+        format = request.args.get("format", "jsonl")
+        if format not in bulk.FORMATS:
+            abort(400)
+
+        mimetype = "text/csv" if format == "csv" else "application/x-ndjson"
+        return Response(stream_with_context(bulk.export_lines(bulk.export_rows(), format)), mimetype=mimetype)
+
     """
     @TODO:
     Create a GET endpoint to get questions based on category.
@@ -183,17 +334,23 @@ def create_app(test_config=None):
     """
 
     @app.route('/categories/<int:category_id>/questions')
+    @caching.conditional('questions', 'categories')
     def retrieve_category_questions(category_id):
-        results = Question.query.filter(Question.category == category_id).all()
-        questions = [result.format() for result in results]
+        query = Question.query.filter(Question.category == category_id)
+        questions = paginate_questions(request, query)
 
         if len(questions) == 0:
             abort(404)
 
+        # counted on the (category, id) index, without reading the questions
+        total_questions = query.with_entities(func.count(Question.id)).scalar()
+        categories = category_cache.get(caching.request_version('categories'))
+
         return jsonify({
             "questions": questions,
-            "totalQuestions": len(questions),
-            "currentCategory": None
+            "totalQuestions": total_questions,
+            "currentCategory": categories.get(category_id),
+            "next_cursor": encode_question_cursor(questions[-1]) if len(questions) == QUESTIONS_PER_PAGE else None
         })
 
     """
@@ -215,24 +372,63 @@ def create_app(test_config=None):
         previous_questions = body.get("previous_questions", None)
         quiz_category = body.get("quiz_category", None)
 
-        if quiz_category['id'] == 0:
-            questions = Question.query.all()
-        else:
-            questions = Question.query.filter(Question.category == quiz_category['id']).all()
-
-        questions = [question.format() for question in questions]
-        questions = [question for question in questions if question['id'] not in previous_questions]
+        question = question_index.pick(quiz_category['id'] or None, set(previous_questions or []))
 
-        if len(questions) == 0:
+        if question is None:
             return jsonify({
                 "question": None,
                 "code": 404
             })
 
-        question = random.choice(questions)
+        return jsonify({
+            "question": question.format()
+        })
+
+    @app.route('/quizzes/sessions', methods=['POST'])
+    def create_quiz_session():
+        body = request.get_json(silent=True) or {}
+        quiz_category = body.get("quiz_category") or {}
+
+        try:
+            category = int(quiz_category.get("id", 0))
+        except (TypeError, ValueError):
+            abort(400)
+
+        session = QuizSession(category or None)
+        quiz_sessions.save(session)
+
+        return jsonify({
+            "success": True,
+            "session_id": session.id,
+            "quiz_category": category
+        })
+
+    @app.route('/quizzes/sessions/<session_id>/next', methods=['POST'])
+    def next_quiz_question(session_id):
+        session = quiz_sessions.get(session_id)
+
+        if session is None:
+            abort(404)
+
+        question = question_index.pick(session.category, session.served)
+        if question is not None:
+            session.served.add(question.id)
+            quiz_sessions.save(session)
+
+        return jsonify({
+            "success": True,
+            "question": question.format() if question is not None else None,
+            "served": len(session.served)
+        })
+
+    @app.route('/quizzes/sessions/<session_id>', methods=['DELETE'])
+    def end_quiz_session(session_id):
+        if not quiz_sessions.delete(session_id):
+            abort(404)
 
         return jsonify({
-            "question": question
+            "success": True,
+            "deleted": session_id
         })
 
     """
@@ -0,0 +1,225 @@
+import json
+import logging
+from urllib.parse import parse_qsl
+
+from asgiref.wsgi import WsgiToAsgi
+from sqlalchemy import func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException, NotFound
+from werkzeug.http import http_date, is_resource_modified, parse_accept_header
+from werkzeug.routing import Map, Rule
+
+from backend.models import Question
+from . import QUESTIONS_PER_PAGE, create_app, encode_question_cursor, page_statements
+from .caching import read_versions, validators, versions_statement
+from .serialization import choose_encoding, compress, dumps
+
+logger = logging.getLogger(__name__)
+
+# the read endpoints served on the async engine, named as the flask views so CACHE_CONTROL
+# applies to both. every other route and method goes to the flask app
+ROUTES = Map([
+    Rule('/categories', endpoint='retrieve_categories', methods=['GET']),
+    Rule('/questions', endpoint='retrieve_questions', methods=['GET']),
+    Rule('/categories/<int:category_id>/questions', endpoint='retrieve_category_questions', methods=['GET']),
+    Rule('/quizzes', endpoint='retrieve_quiz_questions', methods=['POST']),
+])
+ERROR_MESSAGES = {400: 'bad request', 404: 'resource not found', 422: 'unprocessable', 500: 'internal server error'}
+
+
+class AsyncTriviaApp:
+    # an ASGI app answering the read endpoints with the same JSON as the flask views, on asyncpg,
+    # so a worker waits on Postgres for many requests at once. it shares the flask app's caches,
+    # which the writes it hands to the flask app keep current
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.fallback = WsgiToAsgi(flask_app)
+        config = flask_app.config
+        url = make_url(config['SQLALCHEMY_DATABASE_URI']).set(drivername='postgresql+asyncpg')
+        self.engine = create_async_engine(url, **config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+        self.urls = ROUTES.bind('localhost')
+        caches = flask_app.extensions['trivia']
+        self.question_count = caches['question_count']
+        self.category_cache = caches['category_cache']
+        self.question_index = caches['question_index']
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        try:
+            endpoint, values = self.urls.match(scope['path'], scope['method'])
+        except HTTPException:
+            return await self.fallback(scope, receive, send)
+
+        headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in scope['headers']}
+        args = MultiDict(parse_qsl(scope['query_string'].decode('latin-1')))
+        full_path = '{}?{}'.format(scope['path'], scope['query_string'].decode('latin-1'))
+        try:
+            status, body, extra_headers = await getattr(self, endpoint)(args, headers, full_path, receive, **values)
+        except HTTPException as error:
+            status, body, extra_headers = error.code, self.error(error.code), []
+        except Exception:
+            logger.exception('%s %s failed', scope['method'], scope['path'])
+            status, body, extra_headers = 500, self.error(500), []
+        # caching.cache_control()
+        cache_control = self.flask_app.config['CACHE_CONTROL'].get(endpoint)
+        if cache_control and status in (200, 304) and not any(name == 'cache-control' for name, _ in extra_headers):
+            extra_headers.append(('cache-control', cache_control))
+        encoding = choose_encoding(parse_accept_header(headers.get('accept-encoding')))
+        await self.respond(send, status, body, extra_headers + self.cors_headers(), encoding)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # Responses
+    # ----------------------------------------------------------------
+
+    @staticmethod
+    def error(code):
+        return {"success": False, "error": code, "message": ERROR_MESSAGES.get(code, 'error')}
+
+    @staticmethod
+    def cors_headers():
+        # what flask-cors and the flask app's after_request add
+        return [('access-control-allow-origin', '*'),
+                ('access-control-allow-headers', 'Content-Type,Authorization,true'),
+                ('access-control-allow-methods', 'GET,PUT,POST,DELETE,OPTIONS')]
+
+    async def respond(self, send, status, body, headers, encoding=None):
+        # jsonify's output, compressed as serialization.compress_response() would
+        content = b'' if body is None else dumps(body) + b'\n'
+        if body is not None:
+            headers += [('content-type', 'application/json'), ('vary', 'Accept-Encoding')]
+            if encoding is not None and len(content) >= self.flask_app.config['COMPRESS_MIN_SIZE']:
+                content = compress(content, encoding, self.flask_app.config)
+                headers = [('etag', 'W/' + value) if name == 'etag' and not value.startswith('W/') else (name, value)
+                           for name, value in headers]
+                headers.append(('content-encoding', encoding))
+            headers.append(('content-length', str(len(content))))
+        headers = [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': content})
+
+    @staticmethod
+    async def read_json(receive):
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        return json.loads(b''.join(chunks) or b'null')
+
+    # Endpoints
+    # ----------------------------------------------------------------
+
+    @staticmethod
+    async def conditional(connection, tables, headers, full_path):
+        # caching.conditional() on an async connection: (versions, validator headers, modified)
+        versions = read_versions(await connection.execute(versions_statement(tables)))
+        etag, last_modified = validators(versions, tables, full_path)
+        if etag is None:
+            return versions, [], True
+        environ = {'REQUEST_METHOD': 'GET'}
+        for name in ('if-none-match', 'if-modified-since'):
+            if name in headers:
+                environ['HTTP_' + name.upper().replace('-', '_')] = headers[name]
+        modified = is_resource_modified(environ, etag=etag, last_modified=last_modified)
+        return versions, [('etag', 'W/"{}"'.format(etag)), ('last-modified', http_date(last_modified))], modified
+
+    async def paginate(self, connection, statement, args):
+        # paginate_questions() on an async connection
+        page, top_up = page_statements(statement, args)
+        if page is None:
+            return []
+        questions = (await connection.execute(page)).mappings().all()
+        if top_up is not None and len(questions) < QUESTIONS_PER_PAGE:
+            top_up = top_up.limit(QUESTIONS_PER_PAGE - len(questions))
+            questions += (await connection.execute(top_up)).mappings().all()
+        return [dict(question) for question in questions]
+
+    async def retrieve_categories(self, args, headers, full_path, receive):
+        async with self.engine.connect() as connection:
+            versions, validator_headers, modified = await self.conditional(
+                connection, ('categories',), headers, full_path)
+            if not modified:
+                return 304, None, validator_headers
+
+            categories = await self.category_cache.get_async(connection, versions.get('categories', (None,))[0])
+
+        return 200, {"categories": categories}, validator_headers
+
+    async def retrieve_questions(self, args, headers, full_path, receive):
+        async with self.engine.connect() as connection:
+            versions, validator_headers, modified = await self.conditional(
+                connection, ('questions', 'categories'), headers, full_path)
+            if not modified:
+                return 304, None, validator_headers
+
+            questions = await self.paginate(connection, select(Question.__table__), args)
+
+            if len(questions) == 0:
+                raise NotFound()
+
+            total_questions = await self.question_count.get_async(connection, versions.get('questions', (None,))[0])
+            categories = await self.category_cache.get_async(connection, versions.get('categories', (None,))[0])
+
+        return 200, {
+            "questions": questions,
+            "total_questions": total_questions,
+            "categories": categories,
+            "current_category": None,
+            "next_cursor": encode_question_cursor(questions[-1]) if len(questions) == QUESTIONS_PER_PAGE else None
+        }, validator_headers
+
+    async def retrieve_category_questions(self, args, headers, full_path, receive, category_id):
+        async with self.engine.connect() as connection:
+            versions, validator_headers, modified = await self.conditional(
+                connection, ('questions', 'categories'), headers, full_path)
+            if not modified:
+                return 304, None, validator_headers
+
+            statement = select(Question.__table__).where(Question.category == category_id)
+            questions = await self.paginate(connection, statement, args)
+
+            if len(questions) == 0:
+                raise NotFound()
+
+            total_questions = (await connection.execute(
+                select(func.count(Question.id)).where(Question.category == category_id))).scalar()
+            categories = await self.category_cache.get_async(connection, versions.get('categories', (None,))[0])
+
+        return 200, {
+            "questions": questions,
+            "totalQuestions": total_questions,
+            "currentCategory": categories.get(category_id),
+            "next_cursor": encode_question_cursor(questions[-1]) if len(questions) == QUESTIONS_PER_PAGE else None
+        }, validator_headers
+
+    async def retrieve_quiz_questions(self, args, headers, full_path, receive):
+        body = await self.read_json(receive)
+
+        previous_questions = body.get("previous_questions", None)
+        quiz_category = body.get("quiz_category", None)
+
+        async with self.engine.connect() as connection:
+            question = await self.question_index.pick_async(connection, quiz_category['id'] or None,
+                                                            set(previous_questions or []))
+
+        if question is None:
+            return 200, {"question": None, "code": 404}, []
+        return 200, {"question": question}, []
+
+
+def create_asgi_app(test_config=None):
+    # uvicorn --factory flaskr.asgi:create_asgi_app, run from the backend folder with PYTHONPATH=..
+    return AsyncTriviaApp(create_app(test_config))
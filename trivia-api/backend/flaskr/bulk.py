@@ -0,0 +1,211 @@
+import csv
+import json
+import time
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import column, exists, select, values
+
+from backend.models import db, normalized_question_key, question_key, Category, Question
+from .serialization import dumps
+
+# rows per INSERT, each chunk is committed in its own transaction
+CHUNK_SIZE = 1000
+# rows fetched per round trip from the server-side cursor of an export
+EXPORT_BATCH_SIZE = 1000
+FORMATS = ('jsonl', 'csv')
+FIELDS = ['question', 'answer', 'category', 'difficulty']
+
+
+class ImportStats:
+    def __init__(self):
+        self.loaded = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        return (self.loaded + self.duplicates + self.rejected) / self.elapsed if self.elapsed else 0.0
+
+    def format(self):
+        return {'loaded': self.loaded, 'duplicates': self.duplicates, 'rejected': self.rejected}
+
+
+def format_for(name):
+    # jsonl or csv from a file name or content type, None when it is neither
+    name = (name or '').lower()
+    if name.endswith('csv'):
+        return 'csv'
+    if name.endswith(('jsonl', 'ndjson', 'json')):
+        return 'jsonl'
+    return None
+
+
+# Import
+# ----------------------------------------------------------------
+
+def read_rows(file, format):
+    # yields (line number, row) pairs from a text stream without reading it whole;
+    # unparseable lines come back as None
+    if format == 'csv':
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                yield number, json.loads(line)
+            except ValueError:
+                yield number, None
+
+
+def validate(row, category_ids):
+    # returns (values, errors) for one row, with the rules POST /questions relies on the database for
+    if not isinstance(row, dict):
+        return None, {'row': 'not a JSON object'}
+    values, errors = {}, {}
+    for field in ('question', 'answer'):
+        value = row.get(field)
+        if not isinstance(value, str) or not value.strip():
+            errors[field] = 'required'
+        else:
+            values[field] = value.strip()
+    for field, allowed in (('category', category_ids), ('difficulty', range(1, 6))):
+        try:
+            values[field] = int(row.get(field))
+        except (TypeError, ValueError):
+            errors[field] = 'not a number'
+            continue
+        if values[field] not in allowed:
+            errors[field] = 'no such category' if field == 'category' else 'not between 1 and 5'
+    return (None, errors) if errors else (values, None)
+
+
+def load(rows, chunk_size=CHUNK_SIZE, on_reject=None):
+    # validate and insert rows a chunk at a time, one INSERT and one commit per chunk. questions
+    # already in the bank, or earlier in the same import, are skipped as duplicates. only the
+    # current chunk is held, so memory stays flat however large the import
+    category_ids = {category_id for category_id, in db.session.query(Category.id)}
+    stats = ImportStats()
+    chunk = {}
+    for number, row in rows:
+        values, errors = validate(row, category_ids)
+        if errors:
+            stats.rejected += 1
+            if on_reject is not None:
+                on_reject(number, row, errors)
+            continue
+        # only repeats within the chunk, flush() matches the bank in SQL
+        key = normalized_question_key(values['question'])
+        if key in chunk:
+            stats.duplicates += 1
+            continue
+        chunk[key] = values
+        if len(chunk) >= chunk_size:
+            flush(chunk, stats)
+            chunk = {}
+    if chunk:
+        flush(chunk, stats)
+    return stats
+
+
+def flush(chunk, stats):
+    # INSERT ... SELECT of the rows whose key is not in the bank yet, probed on ix_questions_key.
+    # the chunk's keys are computed by the same SQL expression as the index's. earlier chunks are
+    # committed by now, so their questions are found too, and the rows the statement skipped are
+    # the duplicates
+    rows = values(*[column(field, Question.__table__.c[field].type) for field in FIELDS], name='chunk') \
+        .data([tuple(row[field] for field in FIELDS) for row in chunk.values()])
+    new_rows = select(*[rows.c[field] for field in FIELDS]) \
+        .where(~exists().where(question_key() == question_key(rows.c.question)))
+    inserted = db.session.execute(Question.__table__.insert().from_select(FIELDS, new_rows)).rowcount
+    db.session.commit()
+    stats.loaded += inserted
+    stats.duplicates += len(chunk) - inserted
+
+
+# Export
+# ----------------------------------------------------------------
+
+def export_rows(batch_size=EXPORT_BATCH_SIZE):
+    # every question in id order, read through a server-side cursor a batch at a time
+    result = db.session.execute(
+        select(Question.id, *[getattr(Question, field) for field in FIELDS]).order_by(Question.id),
+        execution_options={'stream_results': True, 'max_row_buffer': batch_size})
+    for batch in result.mappings().partitions(batch_size):
+        yield from batch
+
+
+def export_lines(rows, format):
+    # the rows as lines of text, the csv header first
+    if format == 'csv':
+        line = LineBuffer()
+        writer = csv.DictWriter(line, ['id'] + FIELDS)
+        writer.writeheader()
+        yield line.pop()
+        for row in rows:
+            writer.writerow(row)
+            yield line.pop()
+    else:
+        for row in rows:
+            yield dumps(dict(row), sort_keys=False).decode() + '\n'
+
+
+class LineBuffer:
+    # the file csv.writer writes to, handing each written line back
+    def __init__(self):
+        self.lines = []
+
+    def write(self, text):
+        self.lines.append(text)
+
+    def pop(self):
+        text = ''.join(self.lines)
+        self.lines = []
+        return text
+
+
+# Commands
+# ----------------------------------------------------------------
+
+@click.group('questions')
+def questions_cli():
+    """Import and export the question bank."""
+
+
+@questions_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', type=click.Choice(FORMATS), help='Defaults to the file extension.')
+@click.option('--chunk-size', default=CHUNK_SIZE, show_default=True, help='Rows per INSERT and commit.')
+@click.option('--rejects', type=click.File('w'), help='Write rejected rows and their errors here as JSONL.')
+@with_appcontext
+def import_command(path, format, chunk_size, rejects):
+    """Load questions from a CSV or JSONL file, skipping ones already in the bank."""
+
+    def on_reject(number, row, errors):
+        if rejects is not None:
+            rejects.write(json.dumps({'line': number, 'errors': errors, 'row': row}, default=str) + '\n')
+        else:
+            click.echo('line {}: {}'.format(number, errors), err=True)
+
+    with open(path, newline='') as file:
+        stats = load(read_rows(file, format or format_for(path) or 'jsonl'), chunk_size, on_reject)
+    click.echo('{} questions loaded, {} duplicates, {} rejected in {:.1f}s ({:.0f} rows/sec)'.format(
+        stats.loaded, stats.duplicates, stats.rejected, stats.elapsed, stats.rows_per_second))
+
+
+@questions_cli.command('export')
+@click.argument('output', type=click.File('w', lazy=False), default='-')
+@click.option('--format', type=click.Choice(FORMATS), help='Defaults to the file extension, or jsonl.')
+@with_appcontext
+def export_command(output, format):
+    """Write every question to a CSV or JSONL file, or to stdout."""
+    for line in export_lines(export_rows(), format or format_for(output.name) or 'jsonl'):
+        output.write(line)
@@ -0,0 +1,79 @@
+import hashlib
+from functools import wraps
+
+from flask import current_app, g, make_response, request
+from sqlalchemy import select
+from werkzeug.http import is_resource_modified
+
+from backend.models import db, TableVersion
+
+# Cache-Control by endpoint. CACHE_CONTROL in the app config replaces single entries, e.g.
+# {'retrieve_questions': 'public, max-age=30'} lets a CDN serve question pages 30 seconds old.
+# no-cache still lets caches keep a response, but they revalidate it, which costs a 304
+CACHE_CONTROL = {
+    'retrieve_categories': 'public, max-age=60',
+    'retrieve_questions': 'public, no-cache',
+    'retrieve_category_questions': 'public, no-cache',
+}
+
+
+def versions_statement(tables):
+    return select(TableVersion.name, TableVersion.version, TableVersion.updated_at) \
+        .where(TableVersion.name.in_(tables))
+
+
+def read_versions(rows):
+    # {name: (version, updated_at)} from the rows of versions_statement()
+    return {name: (version, updated_at) for name, version, updated_at in rows}
+
+
+def validators(versions, tables, full_path):
+    # (etag, last modified) of the response at full_path built from tables, or (None, None)
+    # when a table has no version
+    if any(table not in versions for table in tables):
+        return None, None
+    key = '{} {}'.format(full_path, ' '.join('{}={}'.format(table, versions[table][0]) for table in tables))
+    return hashlib.sha1(key.encode()).hexdigest(), max(versions[table][1] for table in tables)
+
+
+def conditional(*tables):
+    # answers with 304 Not Modified, without running the view, while none of tables changed
+    # since the client's copy. the only query is the version lookup. the view finds the
+    # versions in g.table_versions. Last-Modified has whole seconds, so clients revalidating
+    # with If-None-Match also see changes made within the second of their copy
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            g.table_versions = read_versions(db.session.execute(versions_statement(tables)))
+            etag, last_modified = validators(g.table_versions, tables, request.full_path)
+            if etag is None:
+                return view(*args, **kwargs)
+            if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            # weak, as the compressed and plain bodies share it
+            response.set_etag(etag, weak=True)
+            response.last_modified = last_modified
+            return response
+        return wrapper
+    return decorator
+
+
+def request_version(table):
+    # the version conditional() read for table in this request, or None
+    return g.get('table_versions', {}).get(table, (None,))[0]
+
+
+def cache_control(response):
+    value = current_app.config['CACHE_CONTROL'].get(request.endpoint)
+    if value and response.status_code in (200, 304) and 'Cache-Control' not in response.headers:
+        response.headers['Cache-Control'] = value
+    return response
+
+
+def init_app(app):
+    app.config['CACHE_CONTROL'] = dict(CACHE_CONTROL, **app.config.get('CACHE_CONTROL', {}))
+    app.after_request(cache_control)
@@ -0,0 +1,56 @@
+import threading
+import time
+
+from sqlalchemy import select
+
+from backend.models import Category, TableVersion, table_version
+
+# seconds the category map is served before the table version is read again
+CATEGORY_VERSION_CHECK = 5
+
+
+class CategoryCache:
+    # the {id: type} map every endpoint returning categories shares. it is reloaded only when
+    # the categories table version, bumped by a trigger on any change, has moved
+    def __init__(self, check_interval=CATEGORY_VERSION_CHECK):
+        self.check_interval = check_interval
+        self.version = None
+        self.categories = None
+        self.checked = 0
+        self.lock = threading.Lock()
+
+    def get(self, version=None):
+        # views that read the categories version already pass it, which also keeps the map from
+        # being older than their etag
+        if version is None:
+            if not self.due():
+                return self.categories
+            version = table_version('categories')
+            self.checked = time.monotonic()
+        # without a version, e.g. on a database without the trigger, every check reloads
+        if self.categories is None or version is None or version != self.version:
+            self.load(version)
+        return self.categories
+
+    async def get_async(self, connection, version=None):
+        # get() on an async connection
+        if version is None:
+            if not self.due():
+                return self.categories
+            version = (await connection.execute(
+                select(TableVersion.version).where(TableVersion.name == 'categories'))).scalar()
+            self.checked = time.monotonic()
+        if self.categories is None or version is None or version != self.version:
+            rows = await connection.execute(select(Category.id, Category.type).order_by(Category.id))
+            self.store(version, dict(rows.all()))
+        return self.categories
+
+    def due(self):
+        return self.categories is None or time.monotonic() - self.checked >= self.check_interval
+
+    def load(self, version):
+        self.store(version, dict(Category.query.with_entities(Category.id, Category.type).order_by(Category.id)))
+
+    def store(self, version, categories):
+        with self.lock:
+            self.version, self.categories = version, categories
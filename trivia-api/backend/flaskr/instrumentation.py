@@ -0,0 +1,14 @@
+from fsnd_common import sql_instrumentation
+
+from backend.models import db
+
+# the instrumentation itself is fsnd_common.sql_instrumentation (common/), shared with fyyur
+
+
+def engines():
+    return [db.engine]
+
+
+def init_app(app):
+    # query count & database time per request, see sql_instrumentation.DEFAULTS for the SQL_* settings
+    sql_instrumentation.init_app(app, engines)
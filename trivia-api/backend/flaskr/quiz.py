@@ -0,0 +1,216 @@
+import random
+import secrets
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+from sqlalchemy import select
+
+from backend.models import db, Question
+
+# seconds between looking for questions other workers added
+QUESTION_INDEX_TTL = 60
+# seconds a quiz session is kept without a turn
+QUIZ_SESSION_TTL = 30 * 60
+# random draws before falling back to listing the eligible ids, when most have been served
+MAX_DRAWS = 8
+
+
+class QuestionIndex:
+    # question ids per category in sorted arrays, so a quiz question is drawn without loading
+    # the questions. this worker's writes are applied as they happen; questions other workers
+    # add are read every ttl seconds, and ones they delete are dropped when drawn
+    def __init__(self, ttl=QUESTION_INDEX_TTL):
+        self.ttl = ttl
+        self.categories = None
+        self.all_ids = None
+        # highest id read from the database, later reads only look above it
+        self.loaded_id = 0
+        self.expires = 0
+        self.lock = threading.Lock()
+
+    def load(self):
+        self.fill(db.session.query(Question.id, Question.category).order_by(Question.id))
+
+    def refresh(self):
+        self.extend(db.session.query(Question.id, Question.category).filter(Question.id > self.loaded_id).all())
+
+    def fill(self, rows):
+        # (id, category) rows in id order
+        categories = {}
+        all_ids = array('q')
+        for question_id, category in rows:
+            categories.setdefault(str(category), array('q')).append(question_id)
+            all_ids.append(question_id)
+        with self.lock:
+            self.categories, self.all_ids = categories, all_ids
+            self.loaded_id = all_ids[-1] if all_ids else 0
+            self.expires = time.monotonic() + self.ttl
+
+    def extend(self, rows):
+        for question_id, category in rows:
+            self.added(question_id, category)
+            self.loaded_id = max(self.loaded_id, question_id)
+        self.expires = time.monotonic() + self.ttl
+
+    def ids(self, category=None):
+        if self.categories is None:
+            self.load()
+        elif time.monotonic() >= self.expires:
+            self.refresh()
+        if category is None:
+            return self.all_ids
+        return self.categories.get(str(category), array('q'))
+
+    def expire(self):
+        # after a bulk import, read the new questions on the next draw
+        self.expires = 0
+
+    def added(self, question_id, category):
+        if self.categories is None:
+            return
+        with self.lock:
+            for ids in (self.all_ids, self.categories.setdefault(str(category), array('q'))):
+                position = bisect_left(ids, question_id)
+                if position == len(ids) or ids[position] != question_id:
+                    ids.insert(position, question_id)
+
+    def removed(self, question_id, category=None):
+        # without a category the id is looked for in every one
+        if self.categories is None:
+            return
+        with self.lock:
+            categories = self.categories.values() if category is None else \
+                [self.categories.get(str(category), array('q'))]
+            for ids in (self.all_ids, *categories):
+                position = bisect_left(ids, question_id)
+                if position < len(ids) and ids[position] == question_id:
+                    del ids[position]
+
+    def draw(self, category=None, exclude=()):
+        # a random id of the category not in exclude, or None once every one is excluded.
+        # exclude is anything with a fast `in`, a set or a ServedSet
+        ids = self.ids(category)
+        # added() and removed() shift the arrays in place, so they are only read under the lock
+        with self.lock:
+            for _ in range(MAX_DRAWS):
+                if not ids:
+                    return None
+                question_id = ids[random.randrange(len(ids))]
+                if question_id not in exclude:
+                    return question_id
+            eligible = [question_id for question_id in ids if question_id not in exclude]
+        return random.choice(eligible) if eligible else None
+
+    def pick(self, category=None, exclude=()):
+        # the drawn question, dropping ids another worker has deleted since the last load
+        while True:
+            question_id = self.draw(category, exclude)
+            if question_id is None:
+                return None
+            question = db.session.get(Question, question_id)
+            if question is not None:
+                return question
+            self.removed(question_id)
+
+    async def pick_async(self, connection, category=None, exclude=()):
+        # pick() on an async connection, returning the question's row as a dict
+        if self.categories is None:
+            self.fill(await connection.execute(select(Question.id, Question.category).order_by(Question.id)))
+        elif time.monotonic() >= self.expires:
+            self.extend(await connection.execute(
+                select(Question.id, Question.category).where(Question.id > self.loaded_id)))
+        while True:
+            question_id = self.draw(category, exclude)
+            if question_id is None:
+                return None
+            question = (await connection.execute(
+                select(Question.__table__).where(Question.id == question_id))).mappings().first()
+            if question is not None:
+                return dict(question)
+            self.removed(question_id)
+
+
+# Sessions
+# ----------------------------------------------------------------
+
+class ServedSet:
+    # ids of the questions a session has served, as a sorted array of 8-byte ints
+    def __init__(self, ids=None):
+        self.ids = ids if ids is not None else array('q')
+
+    def __contains__(self, question_id):
+        position = bisect_left(self.ids, question_id)
+        return position < len(self.ids) and self.ids[position] == question_id
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, question_id):
+        position = bisect_left(self.ids, question_id)
+        if position == len(self.ids) or self.ids[position] != question_id:
+            self.ids.insert(position, question_id)
+
+
+class QuizSession:
+    def __init__(self, category=None, served=None):
+        self.id = secrets.token_urlsafe(16)
+        self.category = category
+        self.served = served or ServedSet()
+
+    def to_bytes(self):
+        # for stores that keep sessions outside the process: category id, then the served ids
+        return struct.pack('<q', self.category or 0) + self.served.ids.tobytes()
+
+    @classmethod
+    def from_bytes(cls, session_id, data):
+        served = array('q')
+        served.frombytes(data[8:])
+        session = cls(struct.unpack('<q', data[:8])[0] or None, ServedSet(served))
+        session.id = session_id
+        return session
+
+
+class MemorySessionStore:
+    # sessions of this worker, dropped after ttl seconds without a turn. a store shared by the
+    # workers needs the same get, save and delete, and can keep QuizSession.to_bytes()
+    def __init__(self, ttl=QUIZ_SESSION_TTL):
+        self.ttl = ttl
+        # least recently used first, so expired sessions are found at the front
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def evict(self, now):
+        while self.sessions:
+            session_id, (_, expires) = next(iter(self.sessions.items()))
+            if expires > now:
+                break
+            del self.sessions[session_id]
+
+    def get(self, session_id):
+        now = time.monotonic()
+        with self.lock:
+            self.evict(now)
+            entry = self.sessions.get(session_id)
+            if entry is None:
+                return None
+            self.sessions[session_id] = (entry[0], now + self.ttl)
+            self.sessions.move_to_end(session_id)
+            return entry[0]
+
+    def save(self, session):
+        now = time.monotonic()
+        with self.lock:
+            self.evict(now)
+            self.sessions[session.id] = (session, now + self.ttl)
+            self.sessions.move_to_end(session.id)
+
+    def delete(self, session_id):
+        with self.lock:
+            return self.sessions.pop(session_id, None) is not None
+
+    def __len__(self):
+        return len(self.sessions)
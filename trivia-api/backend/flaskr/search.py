@@ -0,0 +1,39 @@
+import re
+
+from sqlalchemy import func
+
+from backend.models import db, Question, SEARCH_CONFIG, search_document
+from .serialization import question_rows
+
+WORD = re.compile(r'\w+')
+
+
+def escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def prefix_query(term):
+    # every word of the term, each also matching as the start of a longer word
+    return ' & '.join(word + ':*' for word in WORD.findall(term.lower()))
+
+
+def search_questions(term, page, per_page):
+    # (questions on the page as dicts, total matches), best matches first. words are looked up in the
+    # full-text index on question and answer; a term of only stop words, which the index
+    # drops, is matched as a substring of the question instead
+    words = prefix_query(term)
+    if not words:
+        return [], 0
+    tsquery = func.to_tsquery(SEARCH_CONFIG, words)
+
+    if db.session.query(func.numnode(tsquery)).scalar():
+        document = search_document()
+        matches = Question.query.filter(document.op('@@')(tsquery))
+        ranked = matches.order_by(func.ts_rank(document, tsquery).desc(), Question.id)
+    else:
+        matches = Question.query.filter(Question.question.ilike('%' + escape_like(term) + '%', escape='\\'))
+        ranked = matches.order_by(Question.id)
+
+    total = matches.with_entities(func.count(Question.id)).scalar()
+    questions = question_rows(ranked.offset((page - 1) * per_page).limit(per_page)) if page >= 1 else []
+    return questions, total
@@ -0,0 +1,102 @@
+import gzip
+import json
+
+from flask import current_app, request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from backend.models import Question
+
+# used for settings the app config leaves out
+DEFAULTS = {
+    # smaller responses are sent as they are, compressing them saves less than it costs
+    'COMPRESS_MIN_SIZE': 1024,
+    'COMPRESS_GZIP_LEVEL': 6,
+    # brotli's default of 11 is meant for static files, 4 is faster than gzip 6 and smaller
+    'COMPRESS_BROTLI_QUALITY': 4,
+}
+COMPRESSED_MIMETYPES = {'application/json', 'application/x-ndjson', 'text/csv'}
+
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+QUESTION_COLUMNS = tuple(getattr(Question, field) for field in QUESTION_FIELDS)
+
+
+def question_rows(query):
+    # the query's questions as Question.format() dicts, read as tuples without loading Question objects
+    return [dict(zip(QUESTION_FIELDS, row)) for row in query.with_entities(*QUESTION_COLUMNS)]
+
+
+# JSON
+# ----------------------------------------------------------------
+
+def dumps(obj, sort_keys=True):
+    # compact json as bytes, with orjson when it is installed. keys that are not strings, like
+    # category ids, become strings as with the json module
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(obj, default=DefaultJSONProvider.default, option=option)
+    return json.dumps(obj, default=DefaultJSONProvider.default, sort_keys=sort_keys, separators=(',', ':')).encode()
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    # jsonify() encoding with dumps(); pretty printing, in debug mode, stays with the json module
+    def response(self, *args, **kwargs):
+        if self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj, self.sort_keys) + b'\n', mimetype=self.mimetype)
+
+
+# Compression
+# ----------------------------------------------------------------
+
+def choose_encoding(accept_encodings):
+    # br when the client takes it and brotli is installed, else gzip, from a werkzeug Accept
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding, config):
+    if encoding == 'br':
+        return brotli.compress(data, quality=config['COMPRESS_BROTLI_QUALITY'])
+    return gzip.compress(data, compresslevel=config['COMPRESS_GZIP_LEVEL'])
+
+
+def compress_response(response):
+    # streamed responses, like exports, are left to a proxy, so their memory stays flat
+    if response.direct_passthrough or response.is_streamed or response.mimetype not in COMPRESSED_MIMETYPES \
+            or 'Content-Encoding' in response.headers or response.status_code in (204, 304):
+        return response
+    response.vary.add('Accept-Encoding')
+    config = current_app.config
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None or response.content_length < config['COMPRESS_MIN_SIZE']:
+        return response
+
+    response.set_data(compress(response.get_data(), encoding, config))
+    response.headers['Content-Encoding'] = encoding
+    # the compressed body is another representation, a weak etag still matches If-None-Match
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+    if orjson is not None:
+        app.json = FastJSONProvider(app)
+    app.after_request(compress_response)
@@ -0,0 +1,56 @@
+"""create trivia tables
+
+Revision ID: 3f1c2a7b9d40
+Revises: 
+Create Date: 2026-10-18 14:02:41.208517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a7b9d40'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # databases loaded from trivia.psql, or started before the migrations, already have the
+    # tables, so each one is only created when it is missing
+    tables = sa.inspect(op.get_bind()).get_table_names()
+    if 'categories' not in tables:
+        op.create_table('categories',
+                        sa.Column('id', sa.Integer(), nullable=False),
+                        sa.Column('type', sa.String(), nullable=True),
+                        sa.PrimaryKeyConstraint('id'))
+    if 'questions' not in tables:
+        op.create_table('questions',
+                        sa.Column('id', sa.Integer(), nullable=False),
+                        sa.Column('question', sa.String(), nullable=True),
+                        sa.Column('answer', sa.String(), nullable=True),
+                        sa.Column('category', sa.String(), nullable=True),
+                        sa.Column('difficulty', sa.Integer(), nullable=True),
+                        sa.PrimaryKeyConstraint('id'))
+    if 'table_versions' not in tables:
+        op.create_table('table_versions',
+                        sa.Column('name', sa.String(), nullable=False),
+                        sa.Column('version', sa.BigInteger(), nullable=False),
+                        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'),
+                                  nullable=False),
+                        sa.PrimaryKeyConstraint('name'))
+    # question search, on the expression search_document() in models.py builds. CONCURRENTLY keeps
+    # the table writable during the build, and cannot run inside a transaction
+    with op.get_context().autocommit_block():
+        op.create_index('ix_questions_search', 'questions',
+                        [sa.text("to_tsvector('english'::regconfig, coalesce(question, '') || ' ' || "
+                                 "coalesce(answer, ''))")],
+                        postgresql_using='gin', postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_questions_search', table_name='questions')
+    op.drop_table('table_versions')
+    op.drop_table('questions')
+    op.drop_table('categories')
@@ -0,0 +1,43 @@
+"""integer question category
+
+Revision ID: 8b5e0d4c61a2
+Revises: 3f1c2a7b9d40
+Create Date: 2026-10-18 14:09:17.664032
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b5e0d4c61a2'
+down_revision = '3f1c2a7b9d40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    columns = {column['name']: column for column in inspector.get_columns('questions')}
+    if not isinstance(columns['category']['type'], sa.Integer):
+        # categories that are not an id, or name a category that is gone, become NULL. postgres may
+        # evaluate the operands of OR in any order, so the cast sits in a CASE branch, only reached once
+        # the value is known to be a number that fits an integer
+        op.execute("UPDATE questions SET category = NULL WHERE category IS NOT NULL AND "
+                   "coalesce(CASE WHEN category ~ '^[0-9]{1,9}$' THEN category::integer END "
+                   "NOT IN (SELECT id FROM categories), true)")
+        op.alter_column('questions', 'category', type_=sa.Integer(), existing_type=sa.String(),
+                        postgresql_using="CASE WHEN category ~ '^[0-9]{1,9}$' THEN category::integer END")
+    if not any(key['name'] == 'category' for key in inspector.get_foreign_keys('questions')):
+        op.create_foreign_key('category', 'questions', 'categories', ['category'], ['id'],
+                              onupdate='CASCADE', ondelete='SET NULL')
+    # GET /questions pages in category, id order, built without blocking writes
+    with op.get_context().autocommit_block():
+        op.create_index('ix_questions_category_id', 'questions', ['category', 'id'],
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_questions_category_id', table_name='questions')
+    op.drop_constraint('category', 'questions', type_='foreignkey')
+    op.alter_column('questions', 'category', type_=sa.String(), existing_type=sa.Integer())
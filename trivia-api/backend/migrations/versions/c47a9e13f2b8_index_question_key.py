@@ -0,0 +1,29 @@
+"""index question key
+
+Revision ID: c47a9e13f2b8
+Revises: 8b5e0d4c61a2
+Create Date: 2026-10-18 15:21:36.904172
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47a9e13f2b8'
+down_revision = '8b5e0d4c61a2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # bulk imports look up duplicate questions on question_key(), see models.py. built without
+    # blocking writes
+    with op.get_context().autocommit_block():
+        op.create_index('ix_questions_key', 'questions',
+                        [sa.text("md5(lower(btrim(regexp_replace(question, '\\s+', ' ', 'g'))))")],
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_questions_key', table_name='questions')
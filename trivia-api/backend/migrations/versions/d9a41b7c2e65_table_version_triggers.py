@@ -0,0 +1,45 @@
+"""table version triggers
+
+Revision ID: d9a41b7c2e65
+Revises: c47a9e13f2b8
+Create Date: 2026-10-18 17:44:02.519830
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9a41b7c2e65'
+down_revision = 'c47a9e13f2b8'
+branch_labels = None
+depends_on = None
+
+# tables whose table_versions row is bumped by every statement that changes them, see
+# table_version() in models.py
+VERSIONED_TABLES = ['categories', 'questions']
+
+
+def upgrade():
+    op.execute("""
+        CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO table_versions (name, version, updated_at) VALUES (TG_TABLE_NAME, 1, now())
+            ON CONFLICT (name) DO UPDATE SET version = table_versions.version + 1, updated_at = now();
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    for table in VERSIONED_TABLES:
+        op.execute(sa.text('INSERT INTO table_versions (name, version, updated_at) VALUES (:name, 1, now()) '
+                           'ON CONFLICT (name) DO NOTHING').bindparams(name=table))
+        # replaces the trigger earlier versions of the app created on every start
+        op.execute('DROP TRIGGER IF EXISTS {0}_version ON {0}'.format(table))
+        op.execute('CREATE TRIGGER {0}_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {0} '
+                   'FOR EACH STATEMENT EXECUTE PROCEDURE bump_table_version()'.format(table))
+
+
+def downgrade():
+    for table in VERSIONED_TABLES:
+        op.execute('DROP TRIGGER IF EXISTS {0}_version ON {0}'.format(table))
+    op.execute('DROP FUNCTION IF EXISTS bump_table_version()')
@@ -0,0 +1,67 @@
+"""bump table versions at commit
+
+Revision ID: f3b8c1d07a94
+Revises: d9a41b7c2e65
+Create Date: 2026-10-18 19:12:40.377145
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b8c1d07a94'
+down_revision = 'd9a41b7c2e65'
+branch_labels = None
+depends_on = None
+
+VERSIONED_TABLES = ['categories', 'questions']
+
+
+def upgrade():
+    # every write to a versioned table updates its one table_versions row, and concurrent writers
+    # queue on that row's lock until the holder commits. the bump is therefore deferred to the
+    # commit and made once per table and transaction, so a question_batch() or an import chunk
+    # holds the lock only while it commits. updated_at is the clock at that point, never earlier
+    # than the one before it, so a transaction committing after another cannot move it back
+    op.execute("""
+        CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+        DECLARE
+            bumped text := 'trivia.version_bumped_' || TG_TABLE_NAME;
+        BEGIN
+            IF current_setting(bumped, true) = 'on' THEN
+                RETURN NULL;
+            END IF;
+            PERFORM set_config(bumped, 'on', true);
+            INSERT INTO table_versions (name, version, updated_at) VALUES (TG_TABLE_NAME, 1, clock_timestamp())
+            ON CONFLICT (name) DO UPDATE SET version = table_versions.version + 1,
+                updated_at = greatest(table_versions.updated_at, clock_timestamp());
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    for table in VERSIONED_TABLES:
+        op.execute('DROP TRIGGER IF EXISTS {0}_version ON {0}'.format(table))
+        # constraint triggers are row level only, and TRUNCATE fires no row triggers
+        op.execute('CREATE CONSTRAINT TRIGGER {0}_version AFTER INSERT OR UPDATE OR DELETE ON {0} '
+                   'DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE PROCEDURE bump_table_version()'
+                   .format(table))
+        op.execute('CREATE TRIGGER {0}_version_truncate AFTER TRUNCATE ON {0} '
+                   'FOR EACH STATEMENT EXECUTE PROCEDURE bump_table_version()'.format(table))
+
+
+def downgrade():
+    op.execute("""
+        CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO table_versions (name, version, updated_at) VALUES (TG_TABLE_NAME, 1, now())
+            ON CONFLICT (name) DO UPDATE SET version = table_versions.version + 1, updated_at = now();
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    for table in VERSIONED_TABLES:
+        op.execute('DROP TRIGGER IF EXISTS {0}_version_truncate ON {0}'.format(table))
+        op.execute('DROP TRIGGER IF EXISTS {0}_version ON {0}'.format(table))
+        op.execute('CREATE TRIGGER {0}_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {0} '
+                   'FOR EACH STATEMENT EXECUTE PROCEDURE bump_table_version()'.format(table))
@@ -1,7 +1,12 @@
+import hashlib
 import os
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
 
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Column, String, Integer
+from sqlalchemy import Column, ForeignKey, String, Integer, BigInteger, DateTime, func, literal_column
 
 database_name = os.environ.get('DB_NAME')
 database_path = 'postgresql://{}:{}@{}/{}'.format(os.environ.get('DB_USER'), os.environ.get('DB_PASSWORD'),
@@ -23,6 +28,117 @@ def setup_db(app, database_path=database_path):
     db.create_all()
 
 
+"""
+table_version(name)
+    the version postgres keeps in table_versions for a table, bumped by a trigger on every
+    statement that changes it, including writes from outside the app. the trigger is created by
+    the migrations, so the version is None until `flask db upgrade` has run
+
+"""
+
+
+def table_version(name):
+    return db.session.query(TableVersion.version).filter(TableVersion.name == name).scalar()
+
+
+"""
+search_document()
+    the text question search matches against, the expression ix_questions_search indexes
+
+"""
+
+SEARCH_CONFIG = literal_column("'english'::regconfig")
+
+
+def search_document():
+    return func.to_tsvector(SEARCH_CONFIG, func.coalesce(Question.question, '') + ' ' +
+                            func.coalesce(Question.answer, ''))
+
+
+"""
+question_key(question=Question.question)
+    md5 of the question with case and runs of whitespace ignored, the expression ix_questions_key
+    indexes. compare it against question_key() of another question column, so both sides are
+    normalized by the same database. normalized_question_key(text) only approximates it in python,
+    as the database's regular expressions and lower() follow its own locale: good enough to drop
+    repeated rows before they are sent, never to match the index
+
+"""
+
+WHITESPACE = re.compile(r'[ \t\n\r\f\v]+')
+
+
+def question_key(question=None):
+    if question is None:
+        question = Question.question
+    return func.md5(func.lower(func.btrim(func.regexp_replace(question, literal_column(r"'\s+'"),
+                                                              literal_column("' '"), literal_column("'g'")))))
+
+
+def normalized_question_key(question):
+    return hashlib.md5(WHITESPACE.sub(' ', question).strip(' ').lower().encode()).hexdigest()
+
+
+"""
+question_batch()
+    defers the commits of Question.insert(), update() and delete() inside it. the writes are
+    committed every size writes or seconds, whichever comes first, and at the end of the block,
+    and pending inserts are flushed as multi-row INSERTs. inserted questions get their id at
+    the commit. an exception rolls back the writes not yet committed
+
+"""
+
+BATCH_SIZE = 1000
+BATCH_SECONDS = 1.0
+
+
+class QuestionBatch:
+    def __init__(self, size=BATCH_SIZE, seconds=BATCH_SECONDS):
+        self.size = size
+        self.seconds = seconds
+        self.pending = 0
+        self.started = time.monotonic()
+
+    def wrote(self):
+        self.pending += 1
+        if self.pending >= self.size or time.monotonic() - self.started >= self.seconds:
+            self.commit()
+
+    def commit(self):
+        db.session.commit()
+        self.pending = 0
+        self.started = time.monotonic()
+
+
+current_batch = ContextVar('question_batch', default=None)
+
+
+@contextmanager
+def question_batch(size=BATCH_SIZE, seconds=BATCH_SECONDS):
+    # a batch opened inside another joins it
+    if current_batch.get() is not None:
+        yield current_batch.get()
+        return
+    batch = QuestionBatch(size, seconds)
+    token = current_batch.set(batch)
+    try:
+        yield batch
+        batch.commit()
+    except BaseException:
+        db.session.rollback()
+        raise
+    finally:
+        current_batch.reset(token)
+
+
+def commit_write():
+    batch = current_batch.get()
+    if batch is None:
+        db.session.commit()
+    else:
+        batch.wrote()
+
+
 """
 Question
 
@@ -31,11 +147,13 @@ Question
 
 class Question(db.Model):
     __tablename__ = 'questions'
+    # indexes, e.g. on the expressions search_document() and question_key() build, are created by the
+    # migrations in migrations/versions
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(Integer, ForeignKey('categories.id', name='category', onupdate='CASCADE', ondelete='SET NULL'))
     difficulty = Column(Integer)
 
     def __init__(self, question, answer, category, difficulty):
@@ -46,14 +164,14 @@ class Question(db.Model):
 
     def insert(self):
         db.session.add(self)
-        db.session.commit()
+        commit_write()
 
     def update(self):
-        db.session.commit()
+        commit_write()
 
     def delete(self):
         db.session.delete(self)
-        db.session.commit()
+        commit_write()
 
     def format(self):
         return {
@@ -85,3 +203,18 @@ class Category(db.Model):
             'id': self.id,
             'type': self.type
         }
+
+
+"""
+TableVersion
+    a counter per table, bumped by a trigger whenever the table changes
+
+"""
+
+
+class TableVersion(db.Model):
+    __tablename__ = 'table_versions'
+
+    name = Column(String, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=1)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
@@ -1,26 +1,43 @@
+import asyncio
+import gzip
 import json
 import os
+import sys
+import tempfile
+import threading
 import unittest
 
 from dotenv import load_dotenv
+from flask_migrate import upgrade
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
 
 from flaskr import create_app
-from models import setup_db
+from flaskr.asgi import create_asgi_app
+from flaskr.quiz import MemorySessionStore, QuestionIndex, QuizSession
+from flaskr.serialization import brotli
+from models import setup_db, question_batch, Question
 
 
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
 
+    @classmethod
+    def setUpClass(cls):
+        """Bring the test database up to date with the migrations, which create its triggers and indexes."""
+        load_dotenv()
+        cls.database_name = "trivia_test"
+        cls.database_path = 'postgresql://{}:{}@{}/{}'.format(os.environ.get('DB_TEST_USER'),
+                                                              os.environ.get('DB_TEST_PASSWORD'),
+                                                              os.environ.get('DB_TEST_HOST'), cls.database_name)
+        with create_app({'SQLALCHEMY_DATABASE_URI': cls.database_path}).app_context():
+            upgrade()
+
     def setUp(self):
         """Define test variables and initialize app."""
-        load_dotenv()
         self.app = create_app()
         self.client = self.app.test_client
-        self.database_name = "trivia_test"
-        self.database_path = 'postgresql://{}:{}@{}/{}'.format(os.environ.get('DB_TEST_USER'),
-                                                               os.environ.get('DB_TEST_PASSWORD'),
-                                                               os.environ.get('DB_TEST_HOST'), self.database_name)
         setup_db(self.app, self.database_path)
 
         self.new_question = {"question": "Question 1", "answer": "Answer 1", "difficulty": 1, "category": 1}
@@ -36,6 +53,43 @@ class TriviaTestCase(unittest.TestCase):
         """Executed after reach test"""
         pass
 
+    def execute(self, statement):
+        """Run SQL on the test database outside the app, as another client would."""
+        engine = create_engine(self.database_path)
+        try:
+            with engine.begin() as connection:
+                result = connection.execute(text(statement))
+                return result.fetchall() if result.returns_rows else None
+        finally:
+            engine.dispose()
+
+    def asgi_client(self):
+        """Call the async app the way an ASGI server would, returning (status, headers, body)."""
+        # every call runs on a new event loop, which pooled asyncpg connections cannot move between
+        app = create_asgi_app({'SQLALCHEMY_DATABASE_URI': self.database_path,
+                               'SQLALCHEMY_ENGINE_OPTIONS': {'poolclass': NullPool}})
+
+        async def call(method, path, body=None, headers=()):
+            path, _, query = path.partition('?')
+            content = json.dumps(body).encode() if body is not None else b''
+            headers = list(headers) + [('Content-Length', str(len(content)))]
+            messages = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': content, 'more_body': False}
+
+            async def send(message):
+                messages.append(message)
+
+            await app({'type': 'http', 'http_version': '1.1', 'method': method, 'scheme': 'http', 'path': path,
+                       'root_path': '', 'query_string': query.encode(), 'server': ('localhost', 80),
+                       'headers': [(name.lower().encode(), value.encode()) for name, value in headers]},
+                      receive, send)
+            headers = {name.decode(): value.decode() for name, value in messages[0]['headers']}
+            return messages[0]['status'], headers, b''.join(message.get('body', b'') for message in messages[1:])
+
+        return lambda *args, **kwargs: asyncio.run(call(*args, **kwargs))
+
     """
     TODO
     Write at least one test for each test for successful operation and for expected errors.
@@ -55,12 +109,97 @@ class TriviaTestCase(unittest.TestCase):
         if data['categories'] == 0:
             self.assertEqual(res.status_code, 404)
 
+    def test_304_get_categories_with_etag(self):
+        etag = self.client().get('/categories').headers['ETag']
+        res = self.client().get('/categories', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
+    def test_304_get_categories_if_modified_since(self):
+        res = self.client().get('/categories')
+        not_modified = self.client().get('/categories', headers={'If-Modified-Since': res.headers['Last-Modified']})
+
+        self.assertEqual(res.headers['Cache-Control'], 'public, max-age=60')
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertIn('desc="1 queries"', not_modified.headers['Server-Timing'])
+
+    def test_categories_reload_after_change(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'CATEGORY_VERSION_CHECK': 0})
+        before = app.test_client().get('/categories')
+        category_id = self.execute("INSERT INTO categories (type) VALUES ('Cooking') RETURNING id")[0].id
+        self.addCleanup(self.execute, 'DELETE FROM categories WHERE id = {}'.format(category_id))
+        after = app.test_client().get('/categories')
+
+        self.assertEqual(json.loads(after.data)['categories'][str(category_id)], 'Cooking')
+        self.assertNotEqual(before.headers['ETag'], after.headers['ETag'])
+
     def test_get_paginated_questions(self):
         res = self.client().get('/questions?page=1')
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 200)
 
+    def test_get_questions_after_cursor(self):
+        first_page = json.loads(self.client().get('/questions?page=1').data)
+        second_page = json.loads(self.client().get('/questions?page=2').data)
+        res = self.client().get('/questions?after={}'.format(first_page['next_cursor']))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([question['id'] for question in data['questions']],
+                         [question['id'] for question in second_page['questions']])
+        self.assertEqual(data['total_questions'], first_page['total_questions'])
+
+    def test_total_questions_counts_new_question(self):
+        total = json.loads(self.client().get('/questions').data)['total_questions']
+        self.client().post('/questions', json=self.new_question)
+        data = json.loads(self.client().get('/questions').data)
+
+        self.assertEqual(data['total_questions'], total + 1)
+
+    def test_400_get_questions_bad_cursor(self):
+        res = self.client().get('/questions?after=nonsense')
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_304_get_questions_with_etag(self):
+        etag = self.client().get('/questions?page=2').headers['ETag']
+        res = self.client().get('/questions?page=2', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+        self.assertEqual(res.headers['Cache-Control'], 'public, no-cache')
+        # only the table version lookup ran
+        self.assertIn('desc="1 queries"', res.headers['Server-Timing'])
+
+    def test_questions_etag_changes_after_outside_write(self):
+        before = self.client().get('/questions')
+        question_id = self.execute("INSERT INTO questions (question, answer, category, difficulty) "
+                                   "VALUES ('Outside question', 'Answer', 1, 1) RETURNING id")[0].id
+        self.addCleanup(self.execute, 'DELETE FROM questions WHERE id = {}'.format(question_id))
+        res = self.client().get('/questions', headers={'If-None-Match': before.headers['ETag']})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], before.headers['ETag'])
+        self.assertEqual(json.loads(res.data)['total_questions'], json.loads(before.data)['total_questions'] + 1)
+
+    def test_304_get_category_questions_if_modified_since(self):
+        last_modified = self.client().get('/categories/1/questions').headers['Last-Modified']
+        res = self.client().get('/categories/1/questions', headers={'If-Modified-Since': last_modified})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertNotEqual(self.client().get('/categories/2/questions').headers['ETag'],
+                            self.client().get('/categories/1/questions').headers['ETag'])
+
+    def test_cache_control_from_config(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path,
+                          'CACHE_CONTROL': {'retrieve_questions': 'public, max-age=30'}})
+
+        self.assertEqual(app.test_client().get('/questions').headers['Cache-Control'], 'public, max-age=30')
+        self.assertEqual(app.test_client().get('/categories').headers['Cache-Control'], 'public, max-age=60')
+        self.assertNotIn('Cache-Control', app.test_client().get('/questions?page=1000').headers)
+
     def test_404_get_questions(self):
         res = self.client().get('/questions?page=1000')
         data = json.loads(res.data)
@@ -102,12 +241,142 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['questions'])
         self.assertTrue(data['totalQuestions'])
 
+    def test_search_questions_endpoint(self):
+        res = self.client().post('/questions/search', json={'searchTerm': 'Title'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(6, [question['id'] for question in data['questions']])
+        self.assertEqual(data['total_questions'], len(data['questions']))
+
+    def test_search_questions_matches_answers_and_stop_words(self):
+        by_answer = json.loads(self.client().post('/questions/search', json={'searchTerm': 'angelou'}).data)
+        stop_words = json.loads(self.client().post('/questions/search', json={'searchTerm': 'was the'}).data)
+
+        self.assertEqual([question['id'] for question in by_answer['questions']], [5])
+        self.assertEqual([question['id'] for question in stop_words['questions']], [6])
+
+    def test_400_search_questions_without_term(self):
+        res = self.client().post('/questions/search', json={'searchTerm': ' '})
+
+        self.assertEqual(res.status_code, 400)
+
     def test_422_search_question(self):
         res = self.client().post('/questions', json={'searchTerm': ''})
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 422)
 
+    def test_bulk_import_questions_jsonl(self):
+        self.addCleanup(self.execute, "DELETE FROM questions WHERE question LIKE 'Bulk question%'")
+        lines = [{'question': 'Bulk question 1', 'answer': 'A', 'category': 2, 'difficulty': 1},
+                 {'question': '  bulk   QUESTION 1 ', 'answer': 'B', 'category': 2, 'difficulty': 1},
+                 {'question': 'Bulk question 2', 'answer': 'A', 'category': 1000, 'difficulty': 1}]
+        body = '\n'.join(json.dumps(line) for line in lines) + '\nnot json\n'
+        res = self.client().post('/questions/bulk', data=body, content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual((data['loaded'], data['duplicates'], data['rejected']), (1, 1, 2))
+        self.assertEqual([reject['line'] for reject in data['rejects']], [3, 4])
+
+        res = self.client().post('/questions/bulk', data=body, content_type='application/x-ndjson')
+        self.assertEqual(json.loads(res.data)['duplicates'], 2)
+
+    def test_bulk_import_questions_csv(self):
+        self.addCleanup(self.execute, "DELETE FROM questions WHERE question LIKE 'Bulk question%'")
+        body = 'question,answer,category,difficulty\nBulk question 3,A,2,1\nBulk question 4,A,2,6\n'
+        res = self.client().post('/questions/bulk', data=body, content_type='text/csv')
+        data = json.loads(res.data)
+
+        self.assertEqual((data['loaded'], data['rejected']), (1, 1))
+        self.assertEqual(data['rejects'][0]['errors'], {'difficulty': 'not between 1 and 5'})
+
+    def test_400_bulk_import_questions(self):
+        res = self.client().post('/questions/bulk', data='<questions/>', content_type='application/xml')
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_bulk_export_questions(self):
+        total = json.loads(self.client().get('/questions').data)['total_questions']
+        res = self.client().get('/questions/bulk?format=csv')
+        lines = res.data.decode().splitlines()
+
+        self.assertEqual(res.mimetype, 'text/csv')
+        self.assertEqual(lines[0], 'id,question,answer,category,difficulty')
+        self.assertEqual(len(lines), total + 1)
+
+    def test_questions_import_command(self):
+        self.addCleanup(self.execute, "DELETE FROM questions WHERE question LIKE 'Bulk question%'")
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as file:
+            file.write(json.dumps({'question': 'Bulk question 5', 'answer': 'A', 'category': 3, 'difficulty': 2}))
+        self.addCleanup(os.remove, file.name)
+        result = self.app.test_cli_runner().invoke(args=['questions', 'import', file.name])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('1 questions loaded, 0 duplicates, 0 rejected', result.output)
+
+    def test_questions_import_skips_duplicates_across_chunks(self):
+        self.addCleanup(self.execute, "DELETE FROM questions WHERE question LIKE 'Bulk question%'")
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as file:
+            for question in ('Bulk question 6', 'Bulk question 7', 'bulk  question 6'):
+                file.write(json.dumps({'question': question, 'answer': 'A', 'category': 3, 'difficulty': 2}) + '\n')
+        self.addCleanup(os.remove, file.name)
+        result = self.app.test_cli_runner().invoke(args=['questions', 'import', file.name, '--chunk-size', '1'])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('2 questions loaded, 1 duplicates, 0 rejected', result.output)
+
+    def test_questions_import_matches_the_bank_with_the_database_key(self):
+        # the database counts the em space as whitespace, the python key does not
+        self.addCleanup(self.execute, "DELETE FROM questions WHERE question LIKE 'Bulk question%'")
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as file:
+            for question in ('Bulk question 8', 'Bulk\u2003question 8'):
+                file.write(json.dumps({'question': question, 'answer': 'A', 'category': 3, 'difficulty': 2}) + '\n')
+        self.addCleanup(os.remove, file.name)
+        result = self.app.test_cli_runner().invoke(args=['questions', 'import', file.name, '--chunk-size', '1'])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('1 questions loaded, 1 duplicates, 0 rejected', result.output)
+
+    def test_question_batch_commits_at_the_end(self):
+        self.addCleanup(self.execute, "DELETE FROM questions WHERE question LIKE 'Batch question%'")
+        count = "SELECT count(*) FROM questions WHERE question LIKE 'Batch question%'"
+        with self.app.app_context():
+            with question_batch(size=1000):
+                questions = [Question('Batch question {}'.format(i), 'A', 1, 1) for i in range(3)]
+                for question in questions:
+                    question.insert()
+                self.assertEqual(self.execute(count)[0][0], 0)
+            self.assertEqual(self.execute(count)[0][0], 3)
+            self.assertTrue(all(question.id for question in questions))
+
+    def test_question_batch_bumps_questions_version_once(self):
+        self.addCleanup(self.execute, "DELETE FROM questions WHERE question LIKE 'Batch question%'")
+        version = "SELECT version, updated_at FROM table_versions WHERE name = 'questions'"
+        before = self.execute(version)[0]
+        with self.app.app_context():
+            with question_batch(size=1000):
+                for i in range(3):
+                    Question('Batch question {}'.format(i), 'A', 1, 1).insert()
+                # an INSERT, then a DELETE in the same transaction
+                Question.query.filter(Question.question == 'Batch question 0').one().delete()
+        after = self.execute(version)[0]
+
+        self.assertEqual(after.version, before.version + 1)
+        self.assertGreater(after.updated_at, before.updated_at)
+
+    def test_question_batch_commits_every_size_writes(self):
+        self.addCleanup(self.execute, "DELETE FROM questions WHERE question LIKE 'Batch question%'")
+        count = "SELECT count(*) FROM questions WHERE question LIKE 'Batch question%'"
+        with self.app.app_context():
+            with self.assertRaises(RuntimeError):
+                with question_batch(size=2):
+                    for i in range(3):
+                        Question('Batch question {}'.format(i), 'A', 1, 1).insert()
+                    raise RuntimeError
+            self.assertEqual(self.execute(count)[0][0], 2)
+
     def test_retrieve_category_questions(self):
         res = self.client().get('/categories/1/questions')
         data = json.loads(res.data)
@@ -116,6 +385,20 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['questions'])
         self.assertTrue(data['totalQuestions'])
 
+    def test_retrieve_category_questions_after_cursor(self):
+        self.addCleanup(self.execute, "DELETE FROM questions WHERE question LIKE 'Paged question%'")
+        for number in range(11):
+            self.client().post('/questions', json=dict(self.new_question, question='Paged question {}'.format(number)))
+        first_page = json.loads(self.client().get('/categories/1/questions').data)
+        res = self.client().get('/categories/1/questions?after={}'.format(first_page['next_cursor']))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(first_page['currentCategory'], 'Science')
+        self.assertEqual(len(first_page['questions']) + len(data['questions']), data['totalQuestions'])
+        self.assertTrue(all(question['category'] == 1 for question in data['questions']))
+        self.assertIsNone(data['next_cursor'])
+
     def test_404_retrieve_category_questions(self):
         res = self.client().get('/categories/1000/questions')
         data = json.loads(res.data)
@@ -130,6 +413,82 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['code'], 404)
         self.assertTrue(data['question'])
 
+    def test_quiz_skips_previous_questions(self):
+        ids = [question['id'] for question in
+               json.loads(self.client().get('/categories/1/questions').data)['questions']]
+        quiz_category = {'type': 'Science', 'id': 1}
+
+        res = self.client().post('/quizzes', json={'previous_questions': ids[1:], 'quiz_category': quiz_category})
+        self.assertEqual(json.loads(res.data)['question']['id'], ids[0])
+
+        res = self.client().post('/quizzes', json={'previous_questions': ids, 'quiz_category': quiz_category})
+        self.assertIsNone(json.loads(res.data)['question'])
+
+    def test_quiz_session_serves_each_question_once(self):
+        ids = [question['id'] for question in
+               json.loads(self.client().get('/categories/1/questions').data)['questions']]
+        res = self.client().post('/quizzes/sessions', json={'quiz_category': {'type': 'Science', 'id': 1}})
+        session_id = json.loads(res.data)['session_id']
+
+        served = []
+        for _ in range(len(ids) + 1):
+            data = json.loads(self.client().post('/quizzes/sessions/{}/next'.format(session_id)).data)
+            if data['question'] is None:
+                break
+            served.append(data['question']['id'])
+
+        self.assertEqual(sorted(served), sorted(ids))
+        self.assertEqual(data['served'], len(ids))
+        self.assertEqual(self.client().delete('/quizzes/sessions/{}'.format(session_id)).status_code, 200)
+
+    def test_404_quiz_session(self):
+        res = self.client().post('/quizzes/sessions/unknown/next')
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_quiz_sessions_expire_when_idle(self):
+        store = MemorySessionStore(ttl=0)
+        session = QuizSession(1)
+        store.save(session)
+
+        self.assertIsNone(store.get(session.id))
+        self.assertEqual(len(store), 0)
+
+    def test_quiz_session_bytes_round_trip(self):
+        session = QuizSession(3)
+        for question_id in (9, 2, 5):
+            session.served.add(question_id)
+        restored = QuizSession.from_bytes(session.id, session.to_bytes())
+
+        self.assertEqual(restored.category, 3)
+        self.assertEqual(list(restored.served.ids), [2, 5, 9])
+        self.assertIn(5, restored.served)
+
+    def test_question_index_draws_while_questions_change(self):
+        index = QuestionIndex()
+        index.fill((question_id, 1) for question_id in range(1, 101))
+        done = threading.Event()
+        # switch threads as often as possible, so draws land between a removal and a shift
+        self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+        sys.setswitchinterval(1e-6)
+
+        def churn():
+            while not done.is_set():
+                for question_id in range(1, 101):
+                    index.removed(question_id, 1)
+                for question_id in range(1, 101):
+                    index.added(question_id, 1)
+
+        writer = threading.Thread(target=churn)
+        writer.start()
+        try:
+            drawn = {index.draw(1) for _ in range(20000)}
+        finally:
+            done.set()
+            writer.join()
+
+        self.assertLessEqual(drawn - {None}, set(range(1, 101)))
+
     def test_404_retrieve_quiz_questions(self):
         res = self.client().post('/quizzes',
                                  json={'previous_questions': [], 'quiz_category': {'type': 'Science', 'id': 1000}})
@@ -137,6 +496,104 @@ class TriviaTestCase(unittest.TestCase):
 
         self.assertEqual(res.status_code, 404)
 
+    def test_async_reads_match_sync(self):
+        asgi = self.asgi_client()
+        cursor = json.loads(self.client().get('/questions').data)['next_cursor']
+        for path in ('/categories', '/questions?page=2', '/questions?after={}'.format(cursor),
+                     '/categories/1/questions'):
+            status, _, body = asgi('GET', path)
+
+            self.assertEqual(status, 200, path)
+            self.assertEqual(json.loads(body), json.loads(self.client().get(path).data), path)
+
+    def test_async_404_and_400(self):
+        asgi = self.asgi_client()
+
+        self.assertEqual(asgi('GET', '/questions?page=1000')[0], 404)
+        self.assertEqual(json.loads(asgi('GET', '/categories/1000/questions')[2])['message'], 'resource not found')
+        self.assertEqual(asgi('GET', '/questions?after=bad')[0], 400)
+
+    def test_async_304_categories(self):
+        asgi = self.asgi_client()
+        _, headers, _ = asgi('GET', '/categories')
+        status, _, body = asgi('GET', '/categories', headers=[('If-None-Match', headers['etag'])])
+
+        self.assertEqual(status, 304)
+        self.assertEqual(body, b'')
+
+    def test_async_304_questions_with_sync_etag(self):
+        asgi = self.asgi_client()
+        etag = self.client().get('/questions?page=2').headers['ETag']
+        status, headers, body = asgi('GET', '/questions?page=2', headers=[('If-None-Match', etag)])
+
+        self.assertEqual(status, 304)
+        self.assertEqual(body, b'')
+        self.assertEqual(headers['etag'], etag)
+        self.assertEqual(headers['cache-control'], 'public, no-cache')
+
+    def test_async_quiz_skips_previous_questions(self):
+        asgi = self.asgi_client()
+        ids = [question['id'] for question in
+               json.loads(self.client().get('/categories/1/questions').data)['questions']]
+        quiz_category = {'type': 'Science', 'id': 1}
+
+        _, _, body = asgi('POST', '/quizzes', {'previous_questions': ids[1:], 'quiz_category': quiz_category})
+        self.assertEqual(json.loads(body)['question']['id'], ids[0])
+
+        _, _, body = asgi('POST', '/quizzes', {'previous_questions': ids, 'quiz_category': quiz_category})
+        self.assertIsNone(json.loads(body)['question'])
+
+    def test_async_app_hands_writes_to_flask(self):
+        asgi = self.asgi_client()
+        status, headers, body = asgi('POST', '/questions/search', {'searchTerm': 'title'},
+                                     headers=[('Content-Type', 'application/json')])
+
+        self.assertEqual(status, 200)
+        self.assertTrue(json.loads(body)['success'])
+        self.assertIn('server-timing', headers)
+
+    def test_gzip_response_when_accepted(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'COMPRESS_MIN_SIZE': 0})
+        plain = app.test_client().get('/questions')
+        res = app.test_client().get('/questions', headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(res.data)), json.loads(plain.data))
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        self.assertNotIn('Content-Encoding', plain.headers)
+
+    @unittest.skipIf(brotli is None, 'brotli is not installed')
+    def test_brotli_preferred_over_gzip(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'COMPRESS_MIN_SIZE': 0})
+        res = app.test_client().get('/questions', headers={'Accept-Encoding': 'gzip, br'})
+
+        self.assertEqual(res.headers['Content-Encoding'], 'br')
+        self.assertTrue(json.loads(brotli.decompress(res.data))['questions'])
+
+    def test_304_compressed_categories(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'COMPRESS_MIN_SIZE': 0})
+        etag = app.test_client().get('/categories', headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+        res = app.test_client().get('/categories', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+
+        self.assertTrue(etag.startswith('W/'))
+        self.assertEqual(res.status_code, 304)
+
+    def test_streamed_export_logs_its_queries(self):
+        with self.assertLogs('sql.requests', 'INFO') as requests_log:
+            res = self.client().get('/questions/bulk')
+            res.get_data()
+            res.close()
+
+        # the body's queries run after the headers are sent, so they only reach the log line
+        self.assertNotIn('Server-Timing', res.headers)
+        self.assertGreater(json.loads(requests_log.records[-1].getMessage())['queries'], 0)
+
+    def test_server_timing_reports_request_queries(self):
+        res = self.client().get('/categories')
+
+        self.assertIn('db;dur=', res.headers['Server-Timing'])
+        self.assertNotIn('desc="0 queries"', res.headers['Server-Timing'])
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":